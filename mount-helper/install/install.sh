@@ -13,6 +13,7 @@ CONF_FILE=/etc/ibmcloud/share.conf
 APP_NAME="IBM Mount Share Helper"
 SCRIPT_NAME="mount.ibmshare"
 SBIN_SCRIPT="/sbin/$SCRIPT_NAME"
+APP_MODULE="/usr/lib/$SCRIPT_NAME/mount_ibmshare_app.py"
 MIN_PYTHON3_VERSION=3.4
 MIN_STRONGSWAN_VERSION=5.4
 NA="NOT_SUPPORTED"
@@ -497,7 +498,12 @@ check_python3_installed () {
 disable_metadata () {
 
     log "Disabling metadata service"
-    sed -i 's/USE_METADATA_SERVICE = True/USE_METADATA_SERVICE = False/' $SBIN_SCRIPT
+    # Packages install a launcher in /sbin and the code in $APP_MODULE
+    if [ -f "$APP_MODULE" ]; then
+        sed -i 's/USE_METADATA_SERVICE = True/USE_METADATA_SERVICE = False/' $APP_MODULE
+    else
+        sed -i 's/USE_METADATA_SERVICE = True/USE_METADATA_SERVICE = False/' $SBIN_SCRIPT
+    fi
 }
 
 install_tls_certificates() {
@@ -0,0 +1,93 @@
+# Copyright (c) IBM Corp. 2025. All Rights Reserved.
+# Project name: VPC File Storage Mount Helper
+# This project is licensed under the MIT License, see LICENSE file in the root directory.
+
+# Compare the start up wall time of the single file mount.ibmshare script
+# with the launcher plus precompiled module layout used by the packages.
+# Each run is a new process, when started as root the runs drop to "nobody"
+# so the helper exits right after loading with "Run the mount as super user."
+
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RUNS = 20
+NOBODY_UID = 65534
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+MERGE_SCRIPT = os.path.join(SCRIPTS_DIR, "create_mount_ibmshare.py")
+SRC_DIR = os.path.join(SCRIPTS_DIR, "..", "src")
+
+
+def build(tmp_dir):
+    single = os.path.join(tmp_dir, "single", "mount.ibmshare")
+    root = os.path.join(tmp_dir, "launcher")
+    out = subprocess.DEVNULL
+    subprocess.run([sys.executable, MERGE_SCRIPT, SRC_DIR, single], stdout=out, check=True)
+    subprocess.run(
+        [sys.executable, MERGE_SCRIPT, SRC_DIR, "--launcher", root], stdout=out, check=True
+    )
+    os.chmod(single, 0o755)
+
+    # Point the launcher at the module built here instead of /usr/lib.
+    launcher = os.path.join(root, "sbin", "mount.ibmshare")
+    lib_dir = os.path.join(root, "usr", "lib", "mount.ibmshare")
+    with open(launcher) as fd:
+        data = fd.read()
+    with open(launcher, "w") as fd:
+        fd.write(data.replace('"/usr/lib/mount.ibmshare"', '"%s"' % lib_dir))
+
+    for path, dirs, files in os.walk(tmp_dir):
+        for name in dirs + files:
+            os.chmod(os.path.join(path, name), 0o755)
+    os.chmod(tmp_dir, 0o755)
+    return [("single file", single), ("launcher", launcher)]
+
+
+def drop_root():
+    if os.geteuid() == 0:
+        os.setgid(NOBODY_UID)
+        os.setuid(NOBODY_UID)
+
+
+def run_once(path):
+    start = time.perf_counter()
+    subprocess.run(
+        [path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        preexec_fn=drop_root,
+        cwd="/",
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    tmp_dir = tempfile.mkdtemp(prefix="mount-ibmshare-bench-")
+    try:
+        artefacts = build(tmp_dir)
+        times = {name: [] for name, _ in artefacts}
+        for _ in range(runs):
+            for name, path in artefacts:  # interleave to share any noise
+                times[name].append(run_once(path))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print("%-12s %8s %8s %8s" % ("Artefact", "min ms", "median", "max"))
+    for name, _ in artefacts:
+        vals = [t * 1000 for t in times[name]]
+        print(
+            "%-12s %8.1f %8.1f %8.1f"
+            % (name, min(vals), statistics.median(vals), max(vals))
+        )
+    old = statistics.median(times[artefacts[0][0]])
+    new = statistics.median(times[artefacts[1][0]])
+    print("Launcher speed up: %.2fx (%d runs)" % (old / new, runs))
+
+
+if __name__ == "__main__":
+    main()
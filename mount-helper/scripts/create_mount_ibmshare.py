@@ -5,24 +5,51 @@
 import sys
 import os
 import glob
+import py_compile
 import subprocess
 
 
 out_lines = []
 out_imports = []
 
+# Packaged layout: a small launcher in /sbin imports the merged module from
+# LIB_DIR, so its bytecode is cached instead of compiled on every mount.
+LAUNCHER_FLAG = "--launcher"
+SBIN_SCRIPT = "sbin/mount.ibmshare"
+LIB_DIR = "/usr/lib/mount.ibmshare"
+APP_MODULE = "mount_ibmshare_app"
+
+LAUNCHER = """#!/usr/bin/python3 -IS
+#
+# Copyright (c) IBM Corp. 2025. All Rights Reserved.
+# Project name: VPC File Storage Mount Helper
+# This project is licensed under the MIT License, see LICENSE file in the root directory.
+# Created by merge script.
+# Do not edit.
+import sys
+
+LIB_DIR = "%s"
+sys.path.insert(0, LIB_DIR)
+from %s import main
+
+main()
+"""
+
 py_files = [
     "common",
     "config",
     "certificate_handler",
     "args_handler",
     "file_lock",
+    "metrics",
     "timer_handler",
     "metadata",
     "renew_certs",
     "stunnel_config_get",
     "stunnel_config_create",
     "find_free_stunnel_port",
+    "reconcile_shares",
+    "mount_agent",
     "mount_ibmshare",
 ]
 
@@ -101,6 +128,21 @@ def do_merge(input_folder, out_filename):
     return True
 
 
+def do_launcher(input_folder, build_root):
+    module_dir = os.path.join(build_root, LIB_DIR.lstrip("/"))
+    module_file = os.path.join(module_dir, APP_MODULE + ".py")
+    if not do_merge(input_folder, module_file):
+        return False
+    # Cache for the build interpreter, the packages compile again on install.
+    print("Compile", module_file)
+    py_compile.compile(module_file, doraise=True)
+
+    launcher = os.path.join(build_root, SBIN_SCRIPT)
+    write_file(launcher, LAUNCHER % (LIB_DIR, APP_MODULE))
+    os.chmod(launcher, 0o755)
+    return True
+
+
 def generate_config_file(src_folder):
     install_folder = src_folder.replace("/src", "/install")
     certs_folder = src_folder.replace("/src", "/install/certs/metadata")
@@ -113,8 +155,15 @@ def generate_config_file(src_folder):
 
 def main():
     ret = False
-    if len(sys.argv) != 3:
+    if len(sys.argv) == 4 and sys.argv[2] == LAUNCHER_FLAG:
+        try:
+            ret = do_launcher(sys.argv[1], sys.argv[3])
+        except Exception as ex:
+            print("Exception:", str(ex))
+            ret = False
+    elif len(sys.argv) != 3:
         print("Format: %s <input_folder> <output_filename>" % sys.argv[0])
+        print("        %s <input_folder> %s <build_root>" % (sys.argv[0], LAUNCHER_FLAG))
     else:
         try:
             src_folder = sys.argv[1]
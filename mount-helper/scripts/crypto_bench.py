@@ -0,0 +1,83 @@
+# Copyright (c) IBM Corp. 2025. All Rights Reserved.
+# Project name: VPC File Storage Mount Helper
+# This project is licensed under the MIT License, see LICENSE file in the root directory.
+
+# Compare the crypto backends of the certificate handler: loading a cert,
+# generating a key of each supported type and generating a CSR, once with
+# the openssl command and once in process with the cryptography package
+# when it is installed. Cert loading is also timed with the DER reader.
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+from common import CLIENT_KEY_TYPES, MountHelperLogger  # noqa: E402
+from certificate_handler import (  # noqa: E402
+    CertificateHandler,
+    CryptographyLib,
+    CryptoX509,
+    OpensslCli,
+)
+
+RUNS = 10
+ROOT_CERT_FILE = os.path.join(
+    SRC_DIR, "..", "certs", "prod", "metadata", "type_ibmshare_root_us-south.crt"
+)
+
+
+def timed(func, runs):
+    secs = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        if not func():
+            raise RuntimeError("benchmarked operation failed")
+        secs.append(time.perf_counter() - start)
+    return statistics.median(secs) * 1000
+
+
+def bench_backend(backend, cert, runs):
+    crypto = backend(CertificateHandler())
+    results = {"load cert": timed(lambda: crypto.load_cert(cert), runs)}
+    for key_type in CLIENT_KEY_TYPES:
+        runs_key = max(1, runs // 5) if key_type.startswith("rsa") else runs
+        results["gen key " + key_type] = timed(
+            lambda: crypto.generate_private_key(key_type), runs_key
+        )
+    for key_type in ["rsa4096", "ecdsa-p256"]:
+        pkey = crypto.generate_private_key(key_type)
+        results["gen csr " + key_type] = timed(lambda: crypto.generate_csr(pkey, "-sha256"), runs)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crypto backend micro-benchmark.")
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--cert", default=ROOT_CERT_FILE, help="PEM cert to load")
+    args = parser.parse_args()
+    MountHelperLogger.debug_enabled = False
+
+    with open(args.cert) as fd:
+        cert = fd.read()
+    backends = [OpensslCli]
+    if CryptographyLib.available():
+        backends.append(CryptographyLib)
+    else:
+        print("cryptography is not installed, only openssl is timed")
+
+    results = {backend.NAME: bench_backend(backend, cert, args.runs) for backend in backends}
+    der_ms = timed(lambda: CryptoX509.from_pem(cert), args.runs)
+    names = ["der reader"] + [backend.NAME for backend in backends]
+    print("%-22s" % "Operation (median ms)" + "".join(" %12s" % name for name in names))
+    for op in results[OpensslCli.NAME]:
+        row = ["%12.2f" % der_ms if op == "load cert" else "%12s" % "-"]
+        row += ["%12.2f" % results[backend.NAME][op] for backend in backends]
+        print("%-22s %s" % (op, " ".join(row)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Copyright (c) IBM Corp. 2025. All Rights Reserved.
+# Project name: VPC File Storage Mount Helper
+# This project is licensed under the MIT License, see LICENSE file in the root directory.
+
+# Fail the build if loading the merged mount.ibmshare script gets slower.
+# Uses "python3 -X importtime" so the numbers only cover module imports and
+# the module level code of the script, not the interpreter start up.
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Default budget for all imports done by the merged script, in milliseconds.
+DEFAULT_BUDGET_MS = 60
+RUNS = 5
+
+# Only needed on some code paths, must be imported inside the function using them.
+LAZY_MODULES = [
+    "argparse",
+    "concurrent.futures",
+    "copy",
+    "http.client",
+    "json",
+    "logging.handlers",
+    "socketserver",
+    "ssl",
+    "tempfile",
+    "urllib.request",
+]
+
+LOADER = """
+import sys
+import importlib.util
+from importlib.machinery import SourceFileLoader
+loader = SourceFileLoader("mount_ibmshare_merged", sys.argv[1])
+spec = importlib.util.spec_from_loader(loader.name, loader)
+loader.exec_module(importlib.util.module_from_spec(spec))
+"""
+
+
+# Returns {module: (cumulative_us, depth)}, depth 0 is a top level import.
+def import_times(script):
+    cmd = [sys.executable, "-X", "importtime", "-c", LOADER, script]
+    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if res.returncode != 0:
+        print(res.stderr.decode())
+        raise Exception("Could not load: " + script)
+    times = {}
+    for line in res.stderr.decode().splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # header line
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times[name.strip()] = (int(parts[1]), depth)
+    return times
+
+
+def measure(script, baseline):
+    times = import_times(script)
+    total = 0
+    for name, (cumulative, depth) in times.items():
+        if depth == 0 and name not in baseline:
+            total += cumulative
+    return total, times
+
+
+def main():
+    if len(sys.argv) not in [2, 3]:
+        print("Format: %s <merged_script> [budget_ms]" % sys.argv[0])
+        sys.exit(1)
+    script = sys.argv[1]
+    budget_ms = float(sys.argv[2]) if len(sys.argv) == 3 else DEFAULT_BUDGET_MS
+
+    with tempfile.NamedTemporaryFile(suffix=".py") as empty:
+        baseline = import_times(empty.name)
+
+    totals = []
+    for _ in range(RUNS):
+        total, times = measure(script, baseline)
+        totals.append(total)
+
+    eager = [name for name in LAZY_MODULES if name in times and name not in baseline]
+    median_ms = statistics.median(totals) / 1000.0
+    print(
+        "Import time: %s median %.1fms budget %.1fms (runs: %s)"
+        % (
+            os.path.basename(script),
+            median_ms,
+            budget_ms,
+            ", ".join("%.1f" % (t / 1000.0) for t in totals),
+        )
+    )
+    ok = True
+    if eager:
+        print("Modules must be imported lazily: " + ", ".join(eager))
+        ok = False
+    if median_ms > budget_ms:
+        slowest = sorted(
+            [(t[0], n) for n, t in times.items() if t[1] == 0 and n not in baseline],
+            reverse=True,
+        )[:10]
+        for cumulative, name in slowest:
+            print("  %8.1fms %s" % (cumulative / 1000.0, name))
+        print("Import time budget exceeded.")
+        ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,6 @@
 # Project name: VPC File Storage Mount Helper
 # This project is licensed under the MIT License, see LICENSE file in the root directory.
 
-import argparse
 from enum import Enum
 from common import *
 
@@ -24,6 +23,10 @@ MOUNT_OPTION_IPSEC = "ipsec"
 MOUNT_OPTION_STUNNEL = "stunnel"
 SBIN_SCRIPT = "/sbin/mount.ibmshare"
 TEARDOWN_APP = "-TEARDOWN_APP"
+APPLY_MANIFEST = "--apply"
+RUN_AGENT = "-RUN_AGENT"
+ENABLE_AGENT = "-ENABLE_AGENT"
+DISABLE_AGENT = "-DISABLE_AGENT"
 TLS_ENABLED_OS = ["Ubuntu 24.04", "Red Hat Enterprise Linux 9.4", "Rocky Linux 9.4"]
 
 
@@ -32,6 +35,10 @@ class AppRunType(object):
     TEARDOWN = "TDN"
     RENEW = "REN"
     MOUNT = "MNT"
+    APPLY = "APL"
+    AGENT = "AGT"
+    ENABLE_AGENT = "AEN"
+    DISABLE_AGENT = "ADS"
 
     def __init__(self, value):
         self.value = value
@@ -48,6 +55,18 @@ class AppRunType(object):
     def is_mount(self):
         return self.value == self.MOUNT
 
+    def is_apply(self):
+        return self.value == self.APPLY
+
+    def is_agent(self):
+        return self.value == self.AGENT
+
+    def is_enable_agent(self):
+        return self.value == self.ENABLE_AGENT
+
+    def is_disable_agent(self):
+        return self.value == self.DISABLE_AGENT
+
 
 class ArgsHandler(MountHelperBase):
     """Class to process nfs mount command arguments."""
@@ -72,6 +91,8 @@ class ArgsHandler(MountHelperBase):
             is_error = True
             self.LogError(errmsg)
 
+        import argparse
+
         parser = argparse.ArgumentParser()
         parser.error = parse_error
         parser.add_argument("Source", default="")  # nfs_host:path
@@ -81,8 +102,12 @@ class ArgsHandler(MountHelperBase):
         args, _ = parser.parse_known_args()
         if is_error:
             return False
-        self.mount_source = args.Source
-        self.mount_point = args.Destination
+        return self.set_values(args.Source, args.Destination, args.o)
+
+    # Set the mount args from values instead of the command line.
+    def set_values(self, source, mount_point, opts):
+        self.mount_source = source
+        self.mount_point = mount_point
         self.ip_address, self.mount_path = NfsMount.extract_source(self.mount_source)
         if not self.ip_address or not self.mount_path:
             return self.LogError(
@@ -93,7 +118,7 @@ class ArgsHandler(MountHelperBase):
         if len(self.mount_point) <= 0:
             return self.LogError("Provide the mount point to mount on local host.")
         self.options, self.is_secure, self.is_tls, self.is_stunnel = (
-            self.get_mount_options(args.o)
+            self.get_mount_options(opts)
         )
         return True
 
@@ -114,9 +139,22 @@ class ArgsHandler(MountHelperBase):
     def is_app_teardown():
         return SysApp.has_arg(TEARDOWN_APP)
 
+    @staticmethod
+    def is_apply_manifest():
+        return APPLY_MANIFEST in SysApp.argv()
+
+    @staticmethod
+    def get_manifest_filename():
+        argv = SysApp.argv()
+        pos = argv.index(APPLY_MANIFEST) + 1
+        return argv[pos] if pos < len(argv) else None
+
     def get_renew_certificate_cmd_line(self):
         return SBIN_SCRIPT + " " + RENEW_CERTIFICATE_FLAG
 
+    def get_agent_cmd_line(self):
+        return SBIN_SCRIPT + " " + RUN_AGENT
+
     @staticmethod
     def is_debug_enabled():
         args = str(SysApp.argv())
@@ -131,10 +169,20 @@ class ArgsHandler(MountHelperBase):
             run_type = AppRunType.TEARDOWN
         elif ArgsHandler.is_renew_certificate():
             run_type = AppRunType.RENEW
+        elif ArgsHandler.is_apply_manifest():
+            run_type = AppRunType.APPLY
+        elif SysApp.has_arg(RUN_AGENT):
+            run_type = AppRunType.AGENT
+        elif SysApp.has_arg(ENABLE_AGENT):
+            run_type = AppRunType.ENABLE_AGENT
+        elif SysApp.has_arg(DISABLE_AGENT):
+            run_type = AppRunType.DISABLE_AGENT
         return AppRunType(run_type)
 
     @staticmethod
     def is_request_stunnel():
+        import argparse
+
         parser = argparse.ArgumentParser()
         parser.add_argument("-o", default="")
         args, _ = parser.parse_known_args()
@@ -240,8 +288,9 @@ class ArgsHandler(MountHelperBase):
             system_ctl.check_tls_enabled_os(TLS_ENABLED_OS)
             and system_ctl.is_kernel_version_6_or_higher()
         ):
+            installed = system_ctl.packages_installed(required_packages_for_tls)
             for package in required_packages_for_tls:
-                if system_ctl.tls_package_installed(package):
+                if installed[package]:
                     self.LogDebug(package + " package is installed on the system")
                 else:
                     self.LogError(
@@ -281,8 +330,6 @@ class ArgsHandler(MountHelperBase):
             lines = content.readlines()
             ip_exists = any(line.startswith(self.ip_address) for line in lines)
             if not ip_exists:
-                try:
-                    subprocess.run(["./tls.sh", self.ip_address], check=True)
-                    self.LogInfo("Added ip address in /etc/hosts.")
-                except subprocess.CalledProcessError as e:
+                if not self.RunCmd(["./tls.sh", self.ip_address], "AddHostsEntry"):
                     sys.exit(0)
+                self.LogInfo("Added ip address in /etc/hosts.")
@@ -5,13 +5,185 @@
 # This project is licensed under the MIT License, see LICENSE file in the root directory.
 
 
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from common import *
-
-RSA_KEY_LENGTH = 4096
+from metrics import Metrics
+
+# openssl genpkey options for each client_key_type in share.conf
+KEY_GEN_OPTS = {
+    "rsa2048": ["-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:2048"],
+    "rsa3072": ["-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:3072"],
+    "rsa4096": ["-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:4096"],
+    "ecdsa-p256": ["-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-256"],
+    "ecdsa-p384": ["-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-384"],
+}
 CERT_VALID_LIFE_REMAINS = 0.3
+MACHINE_ID_FILES = ["/etc/machine-id", "/var/lib/dbus/machine-id"]
 OPENSSL_CSR_SUBJECT = "/C=US/ST=IL/L=Chicago/O=IBM Corporation/OU=IBM Software Group"
 ALERT_CA_BEFORE = 270
+OPENSSL_TIMEOUT = 60
+X509_INFO_ARGS = ["-noout", "-dates", "-subject", "-issuer"]
+# Read certificates with the crypto backend instead of the DER reader.
+X509_USE_BACKEND = False
+# Force the "openssl" or "cryptography" crypto backend, None picks one.
+CRYPTO_BACKEND = None
+
+PEM_BEGIN = "-----BEGIN %s-----"
+PEM_END = "-----END %s-----"
+DER_INTEGER = 0x02
+DER_OCTET_STRING = 0x04
+DER_SEQUENCE = 0x30
+DER_SET = 0x31
+DER_OID = 0x06
+DER_UTC_TIME = 0x17
+DER_GENERALIZED_TIME = 0x18
+DER_BMP_STRING = 0x1E
+DER_EXPLICIT_0 = 0xA0
+X509_NAME_ATTRS = {
+    "2.5.4.3": "CN",
+    "2.5.4.5": "serialNumber",
+    "2.5.4.6": "C",
+    "2.5.4.7": "L",
+    "2.5.4.8": "ST",
+    "2.5.4.10": "O",
+    "2.5.4.11": "OU",
+    "1.2.840.113549.1.9.1": "emailAddress",
+    "0.9.2342.19200300.100.1.25": "DC",
+}
+KEY_OID_RSA = "1.2.840.113549.1.1.1"
+KEY_OID_EC = "1.2.840.10045.2.1"
+EC_CURVE_KEY_TYPES = {
+    "1.2.840.10045.3.1.7": "ecdsa-p256",
+    "1.3.132.0.34": "ecdsa-p384",
+}
+
+
+class DerReader:
+    """Minimal DER walker, only what is needed to read a certificate."""
+
+    def __init__(self, data, pos=0, end=None):
+        self.data = data
+        self.pos = pos
+        self.end = len(data) if end is None else end
+
+    def more(self):
+        return self.pos < self.end
+
+    # Return (tag, value start, value end) of the next element and skip it.
+    def next(self):
+        data = self.data
+        tag = data[self.pos]
+        size = data[self.pos + 1]
+        pos = self.pos + 2
+        if size & 0x80:
+            count = size & 0x7F
+            if count == 0 or count > 4:
+                raise ValueError("Unsupported DER length")
+            size = int.from_bytes(data[pos : pos + count], "big")
+            pos += count
+        if pos + size > self.end:
+            raise ValueError("DER element overruns its parent")
+        self.pos = pos + size
+        return tag, pos, pos + size
+
+    def expect(self, tag):
+        found, start, end = self.next()
+        if found != tag:
+            raise ValueError("Expected DER tag 0x%02x got 0x%02x" % (tag, found))
+        return start, end
+
+    def enter(self, tag):
+        start, end = self.expect(tag)
+        return DerReader(self.data, start, end)
+
+
+def der_oid(data):
+    first = data[0]
+    parts = [min(first // 40, 2), first - 40 * min(first // 40, 2)]
+    val = 0
+    for byte in data[1:]:
+        val = (val << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            parts.append(val)
+            val = 0
+    return ".".join(str(part) for part in parts)
+
+
+def der_time(tag, data):
+    txt = data.decode("ascii").rstrip("Z")
+    if tag == DER_UTC_TIME:
+        year = int(txt[:2])
+        txt = ("19" if year >= 50 else "20") + txt
+    elif tag != DER_GENERALIZED_TIME:
+        raise ValueError("Unsupported DER time tag 0x%02x" % tag)
+    return datetime.strptime(txt[:14], "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+
+
+# Format a Name like openssl does, eg "C = US, O = IBM, CN = host".
+def der_name(reader):
+    rdns = []
+    while reader.more():
+        rdn = reader.enter(DER_SET)
+        while rdn.more():
+            attr = rdn.enter(DER_SEQUENCE)
+            oid = der_oid(attr.data[slice(*attr.expect(DER_OID))])
+            tag, start, end = attr.next()
+            if tag == DER_BMP_STRING:
+                value = attr.data[start:end].decode("utf-16-be")
+            else:
+                value = attr.data[start:end].decode("utf-8", errors="replace")
+            rdns.append(name_part(oid, value))
+    return ", ".join(rdns)
+
+
+def name_part(oid, value):
+    if "," in value:
+        value = '"%s"' % value
+    return "%s = %s" % (X509_NAME_ATTRS.get(oid, oid), value)
+
+
+def colon_hex(digest):
+    return ":".join("%02X" % byte for byte in digest)
+
+
+# Return the DER bytes of the first label block in PEM text, or DER as is.
+def pem_to_der(data, label="CERTIFICATE"):
+    import base64
+
+    if isinstance(data, bytes):
+        if data[:1] == bytes([DER_SEQUENCE]):
+            return data
+        data = data.decode("ascii", errors="replace")
+    begin = PEM_BEGIN % label
+    start = data.find(begin)
+    end = data.find(PEM_END % label, start)
+    if start < 0 or end < 0:
+        return None
+    body = data[start + len(begin) : end]
+    return base64.b64decode("".join(body.split()), validate=True)
+
+
+# Return the client_key_type of a PKCS#8 private key, None if not known.
+def private_key_type(data):
+    try:
+        der = pem_to_der(data, "PRIVATE KEY")
+        if not der:
+            return None
+        info = DerReader(der).enter(DER_SEQUENCE)
+        info.expect(DER_INTEGER)  # version
+        alg = info.enter(DER_SEQUENCE)
+        oid = der_oid(der[slice(*alg.expect(DER_OID))])
+        if oid == KEY_OID_EC:
+            return EC_CURVE_KEY_TYPES.get(der_oid(der[slice(*alg.expect(DER_OID))]))
+        if oid == KEY_OID_RSA:
+            start, end = info.expect(DER_OCTET_STRING)
+            rsa = DerReader(der, start, end).enter(DER_SEQUENCE)
+            rsa.expect(DER_INTEGER)  # version
+            start, end = rsa.expect(DER_INTEGER)  # modulus
+            return "rsa%d" % int.from_bytes(der[start:end], "big").bit_length()
+    except (ValueError, IndexError):
+        pass
+    return None
 
 
 class CryptoX509:
@@ -20,6 +192,34 @@ class CryptoX509:
         self.not_before = None
         self.subject = None
         self.issuer = None
+        self.fingerprint = None
+        self.renew_at = None
+
+    # Fill the fields from PEM or DER data, None if it is not a certificate.
+    @staticmethod
+    def from_pem(data):
+        import hashlib
+
+        try:
+            der = pem_to_der(data)
+            if not der:
+                return None
+            tbs = DerReader(der).enter(DER_SEQUENCE).enter(DER_SEQUENCE)
+            if tbs.next()[0] == DER_EXPLICIT_0:  # version
+                tbs.next()  # serial number
+            tbs.expect(DER_SEQUENCE)  # signature algorithm
+            crt = CryptoX509()
+            crt.issuer = der_name(tbs.enter(DER_SEQUENCE))
+            validity = tbs.enter(DER_SEQUENCE)
+            tag, start, end = validity.next()
+            crt.not_before = der_time(tag, der[start:end])
+            tag, start, end = validity.next()
+            crt.not_after = der_time(tag, der[start:end])
+            crt.subject = der_name(tbs.enter(DER_SEQUENCE))
+            crt.fingerprint = colon_hex(hashlib.sha256(der).digest())
+            return crt
+        except (ValueError, IndexError, UnicodeError):
+            return None
 
     def set_subject(self, data):
         self.subject = data
@@ -39,6 +239,312 @@ class CryptoX509:
         return self.not_before and self.not_after
 
 
+# From this date the cert can be renewed.
+# Latest renewal, CERT_VALID_LIFE_REMAINS of the life is the safety margin.
+def renewal_date(not_before, not_after):
+    mins = divmod((not_after - not_before).total_seconds(), 60)
+    return get_utc_date(not_after, minutes=-(mins[0] * CERT_VALID_LIFE_REMAINS))
+
+
+# Fixed position of this host in the renewal window, in [0, 1).
+def host_fraction():
+    import hashlib
+
+    host_id = None
+    for fpath in MACHINE_ID_FILES:
+        try:
+            with open(fpath) as fd:
+                host_id = fd.read().strip()
+        except OSError:
+            continue
+        if host_id:
+            break
+    host_id = host_id or socket.gethostname()
+    digest = hashlib.sha256(host_id.encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) / float(1 << 32)
+
+
+class CertCache(JsonStateCache):
+    """Parsed fields of the managed certs, so unchanged files are not read.
+
+    An entry is used as is while the file stat matches, a changed stat with
+    the same sha256 only refreshes the stat. It also remembers when the last
+    CA expiry alert for the file was logged.
+    """
+
+    CACHE_FILE = LocalInstall.make_filename("cert-cache.json")
+    FIELDS = ["subject", "issuer", "fingerprint"]
+    DATES = ["not_before", "not_after", "renew_at"]
+    cache = None
+
+    @staticmethod
+    def stat_key(fpath):
+        try:
+            st = os.stat(fpath)
+            return [st.st_size, st.st_mtime_ns, st.st_ino]
+        except OSError:
+            return None
+
+    @staticmethod
+    def file_hash(fpath):
+        import hashlib
+
+        try:
+            with open(fpath, "rb") as fd:
+                return hashlib.sha256(fd.read()).hexdigest()
+        except OSError:
+            return None
+
+    # Return (stat key, cached cert or None), the key is None if no file.
+    def get(self, fpath):
+        key = CertCache.stat_key(fpath)
+        entry = self.load_cache().get(fpath)
+        if not key or not entry:
+            return key, None
+        if entry["stat"] != key:
+            if entry["sha256"] != CertCache.file_hash(fpath):
+                return key, None
+            entry["stat"] = key  # touched, not changed
+            self.save_cache()
+        crt = CryptoX509()
+        for name in CertCache.FIELDS:
+            setattr(crt, name, entry[name])
+        for name in CertCache.DATES:
+            setattr(crt, name, datetime.fromtimestamp(entry[name], timezone.utc))
+        return key, crt
+
+    def put(self, fpath, key, crt):
+        entry = {"stat": key, "sha256": CertCache.file_hash(fpath)}
+        for name in CertCache.FIELDS:
+            entry[name] = getattr(crt, name)
+        crt.renew_at = renewal_date(crt.not_before, crt.not_after)
+        for name in CertCache.DATES:
+            entry[name] = getattr(crt, name).timestamp()
+        old = self.load_cache().get(fpath) or {}
+        if old.get("sha256") == entry["sha256"] and "alerted_at" in old:
+            entry["alerted_at"] = old["alerted_at"]
+        CertCache.cache[fpath] = entry
+
+    # True at most once per interval for each cert.
+    def alert_due(self, fpath, interval):
+        entry = self.load_cache().get(fpath)
+        now = time.time()
+        if entry is not None:
+            if now - entry.get("alerted_at", 0) < interval:
+                return False
+            entry["alerted_at"] = now
+            self.save_cache()
+        return True
+
+
+class CryptoBackend(object):
+    """Key, CSR and cert operations, picked once per process.
+
+    CryptographyLib runs them in process when the cryptography package can
+    be imported, OpensslCli runs the openssl command otherwise. Keys and CSRs
+    are PEM text, certs are returned as CryptoX509 (None on error).
+    """
+
+    NAME = None
+    selected = None
+
+    def __init__(self, handler):
+        self.handler = handler  # logs and runs commands
+
+    @staticmethod
+    def get_class():
+        if CryptoBackend.selected is None:
+            name = CRYPTO_BACKEND
+            if name is None:
+                name = "cryptography" if CryptographyLib.available() else "openssl"
+            for backend in [CryptographyLib, OpensslCli]:
+                if backend.NAME == name:
+                    CryptoBackend.selected = backend
+            MountHelperLogger().LogDebug("Crypto backend: " + name)
+        return CryptoBackend.selected
+
+    def load_certs(self, fpaths):
+        raise NotImplementedError
+
+    def load_cert(self, data):
+        raise NotImplementedError
+
+    def check_private_key(self, data):
+        raise NotImplementedError
+
+    def generate_private_key(self, key_type):
+        raise NotImplementedError
+
+    def generate_csr(self, private_key, digest):
+        raise NotImplementedError
+
+    def validate_csr(self, csr):
+        raise NotImplementedError
+
+
+class OpensslCli(CryptoBackend):
+    NAME = "openssl"
+
+    def load_certs(self, fpaths):
+        cmds = [["openssl", "x509", "-in", fpath] + X509_INFO_ARGS for fpath in fpaths]
+        outs = self.handler.RunCmds(cmds, "LoadCert", timeout=OPENSSL_TIMEOUT)
+        return [CertificateHandler.parse_x509(out) for out in outs]
+
+    def load_cert(self, data):
+        out = self.handler.run_openssl(["x509"] + X509_INFO_ARGS, "LoadCert", stdin=data)
+        return CertificateHandler.parse_x509(out)
+
+    def check_private_key(self, data):
+        cmd = ["pkey", "-check", "-noout"]
+        return self.handler.run_openssl(cmd, "LoadPrivateKey", stdin=data) is not None
+
+    def generate_private_key(self, key_type):
+        cmd = ["genpkey"] + KEY_GEN_OPTS[key_type] + ["-outform", "PEM"]
+        out = self.handler.run_openssl(cmd, "GenPrivateKey")
+        if out and out.stdout:
+            return out.stdout + "\n"
+        return None
+
+    def generate_csr(self, private_key, digest):
+        # openssl req -key server.key -new, key on stdin and csr on stdout
+        cmd = ["req", "-nodes", digest, "-new", "-subj", OPENSSL_CSR_SUBJECT]
+        cmd += ["-key", "/dev/stdin"]
+        out = self.handler.run_openssl(cmd, "GenCSR", stdin=private_key)
+        if out and out.stdout:
+            return out.stdout + "\n"
+        return None
+
+    def validate_csr(self, csr):
+        cmd = ["req", "-text", "-noout", "-verify"]
+        return self.handler.run_openssl(cmd, "CheckCSR", stdin=csr) is not None
+
+
+class CryptographyLib(CryptoBackend):
+    NAME = "cryptography"
+
+    # Imported with import_optional, the packaged launcher runs without site.
+    @staticmethod
+    def module(name):
+        return import_optional("cryptography." + name)
+
+    @staticmethod
+    def available():
+        try:
+            CryptographyLib.module("x509")
+            return True
+        except Exception:  # not installed or a broken install
+            return False
+
+    def failed(self, descr, ex):
+        self.handler.LogError("%s failed: %s" % (descr, str(ex)))
+        return None
+
+    @staticmethod
+    def to_x509(cert):
+        hashes = CryptographyLib.module("hazmat.primitives.hashes")
+
+        crt = CryptoX509()
+        crt.not_before = getattr(cert, "not_valid_before_utc", None)
+        crt.not_after = getattr(cert, "not_valid_after_utc", None)
+        if not crt.not_before:  # before cryptography 42
+            crt.not_before = to_utc(cert.not_valid_before)
+            crt.not_after = to_utc(cert.not_valid_after)
+        for field in ["subject", "issuer"]:
+            parts = [name_part(attr.oid.dotted_string, attr.value) for attr in getattr(cert, field)]
+            setattr(crt, field, ", ".join(parts))
+        crt.fingerprint = colon_hex(cert.fingerprint(hashes.SHA256()))
+        return crt
+
+    def load_certs(self, fpaths):
+        crts = []
+        for fpath in fpaths:
+            try:
+                with open(fpath, "rb") as fd:
+                    crts.append(self.load_cert(fd.read()))
+            except OSError as ex:
+                crts.append(self.failed("LoadCert", ex))
+        return crts
+
+    def load_cert(self, data):
+        x509 = CryptographyLib.module("x509")
+
+        try:
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            return CryptographyLib.to_x509(x509.load_pem_x509_certificate(data))
+        except ValueError as ex:
+            return self.failed("LoadCert", ex)
+
+    # The RSA consistency check costs more than signing with a 4096 bit key,
+    # it is skipped when the key was checked or generated before.
+    def load_key(self, data, check=True):
+        serialization = CryptographyLib.module("hazmat.primitives.serialization")
+
+        data = data.encode("utf-8")
+        if not check:
+            try:
+                return serialization.load_pem_private_key(
+                    data, password=None, unsafe_skip_rsa_key_validation=True
+                )
+            except TypeError:  # before cryptography 39
+                pass
+        return serialization.load_pem_private_key(data, password=None)
+
+    def check_private_key(self, data):
+        UnsupportedAlgorithm = CryptographyLib.module("exceptions").UnsupportedAlgorithm
+
+        try:
+            return self.load_key(data) is not None
+        except (ValueError, TypeError, UnsupportedAlgorithm) as ex:
+            return bool(self.failed("LoadPrivateKey", ex))
+
+    def generate_private_key(self, key_type):
+        serialization = CryptographyLib.module("hazmat.primitives.serialization")
+        ec = CryptographyLib.module("hazmat.primitives.asymmetric.ec")
+        rsa = CryptographyLib.module("hazmat.primitives.asymmetric.rsa")
+
+        if key_type.startswith("rsa"):
+            key = rsa.generate_private_key(public_exponent=65537, key_size=int(key_type[3:]))
+        else:
+            curve = ec.SECP256R1() if key_type == "ecdsa-p256" else ec.SECP384R1()
+            key = ec.generate_private_key(curve)
+        data = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+        return data.decode("utf-8")
+
+    def generate_csr(self, private_key, digest):
+        x509 = CryptographyLib.module("x509")
+        UnsupportedAlgorithm = CryptographyLib.module("exceptions").UnsupportedAlgorithm
+        hashes = CryptographyLib.module("hazmat.primitives.hashes")
+        serialization = CryptographyLib.module("hazmat.primitives.serialization")
+
+        algorithm = getattr(hashes, digest.lstrip("-").upper(), None)
+        if not algorithm:
+            return self.failed("GenCSR", "unknown digest " + digest)
+        oids = {short: oid for oid, short in X509_NAME_ATTRS.items()}
+        names = []
+        for part in OPENSSL_CSR_SUBJECT.strip("/").split("/"):
+            short, value = part.split("=", 1)
+            names.append(x509.NameAttribute(x509.ObjectIdentifier(oids[short]), value))
+        try:
+            builder = x509.CertificateSigningRequestBuilder().subject_name(x509.Name(names))
+            csr = builder.sign(self.load_key(private_key, check=False), algorithm())
+        except (ValueError, TypeError, UnsupportedAlgorithm) as ex:
+            return self.failed("GenCSR", ex)
+        return csr.public_bytes(serialization.Encoding.PEM).decode("utf-8")
+
+    def validate_csr(self, csr):
+        x509 = CryptographyLib.module("x509")
+
+        try:
+            return x509.load_pem_x509_csr(csr.encode("utf-8")).is_signature_valid
+        except ValueError as ex:
+            return bool(self.failed("CheckCSR", ex))
+
+
 class CertificateHandler(MountHelperBase):
     """Class to handle certificate expiration."""
 
@@ -68,7 +574,9 @@ class CertificateHandler(MountHelperBase):
         return len(self.get_ipsec_mgr().root_cert_filenames()) > 0
 
     def load_certificate(self):
-        return self.load_certificate_by_filename(self.cert_filename())
+        ret = self.load_certificate_by_filename(self.cert_filename())
+        Metrics.cert_expiry("client", self.crypto_x509)
+        return ret
 
     def load_int_ca_certificate(self):
         return self.load_certificate_by_filename(self.int_ca_filename())
@@ -76,28 +584,73 @@ class CertificateHandler(MountHelperBase):
     def load_root_ca_certificate(self):
         return self.load_certificate_by_filename(self.root_ca_filename())
 
-    def run_openssl(self, cmd, descr):
+    def crypto(self):
+        return CryptoBackend.get_class()(self)
+
+    # Input and output go over pipes, so no key material is written to disk.
+    def run_openssl(self, cmd, descr, stdin=None):
         openssl_cmd = ["openssl"] + cmd
-        return self.RunCmd(openssl_cmd, descr)
+        return self.RunCmd(openssl_cmd, descr, timeout=OPENSSL_TIMEOUT, stdin=stdin)
+
+    @staticmethod
+    def parse_x509(out):
+        if out:
+            crt = CryptoX509()
+            if crt.set_dates(
+                out.get_stdout_val("notBefore=", True),
+                out.get_stdout_val("notAfter=", True),
+            ):
+                crt.set_subject(out.get_stdout_val("subject=", True))
+                crt.set_issuer(out.get_stdout_val("issuer=", True))
+                return crt
+        return None
+
+    # In process read of cert data, None if openssl has to be used.
+    def read_x509(self, data=None, fpath=None):
+        if X509_USE_BACKEND:
+            return None
+        try:
+            if fpath:
+                with open(fpath, "rb") as fd:
+                    data = fd.read()
+            crt = CryptoX509.from_pem(data)
+            if crt:
+                return crt
+        except OSError as ex:
+            self.LogDebug("Cannot read %s: %s" % (fpath, str(ex)))
+        self.LogDebug("Certificate not read by the DER reader, using the backend")
+        return None
 
+    @traced("cert_load")
     def load_certificate_by_filename(self, fpath):
-        self.crypto_x509 = None
-        if self.FileExists(fpath):
-            out = self.run_openssl(
-                ["x509", "-in", fpath, "-noout", "-dates", "-subject", "-issuer"],
-                "LoadCert",
-            )
-            if out:
-                crt = CryptoX509()
-                if crt.set_dates(
-                    out.get_stdout_val("notBefore=", True),
-                    out.get_stdout_val("notAfter=", True),
-                ):
-                    crt.set_subject(out.get_stdout_val("subject=", True))
-                    crt.set_issuer(out.get_stdout_val("issuer=", True))
-                    self.crypto_x509 = crt
+        self.crypto_x509 = self.load_x509_files([fpath])[0]
         return self.is_loaded()
 
+    @traced("cert_load")
+    def load_certificates(self, fpaths):
+        return self.load_x509_files(fpaths)
+
+    # Load independent certs, unchanged files from the cert cache, the others
+    # with the DER reader or the crypto backend. None if not loaded.
+    def load_x509_files(self, fpaths):
+        cache = CertCache()
+        crts = {}
+        keys = {}
+        for fpath in fpaths:
+            keys[fpath], crts[fpath] = cache.get(fpath)
+        found = [fpath for fpath in fpaths if keys[fpath] and not crts[fpath]]
+        for fpath in found:
+            crts[fpath] = self.read_x509(fpath=fpath)
+        pending = [fpath for fpath in found if not crts[fpath]]
+        if pending:
+            crts.update(zip(pending, self.crypto().load_certs(pending)))
+        for fpath in found:
+            if crts[fpath]:
+                cache.put(fpath, keys[fpath], crts[fpath])
+        if any(crts[fpath] for fpath in found):
+            cache.save_cache()
+        return [crts[fpath] for fpath in fpaths]
+
     def get_subject(self):
         return self.crypto_x509.subject
 
@@ -105,12 +658,10 @@ class CertificateHandler(MountHelperBase):
         return self.crypto_x509.issuer
 
     def load_cert(self, data):
-        try:
-            with TempFile(data) as cert:
-                return self.load_certificate_by_filename(cert.filename)
-        except Exception as ex:
-            self.LogException("LoadX509Certificate", ex)
-        return None
+        self.crypto_x509 = self.read_x509(data)
+        if not self.crypto_x509:
+            self.crypto_x509 = self.crypto().load_cert(data)
+        return self.is_loaded()
 
     def get_certificate_not_after_date(self):
         if not self.is_loaded():
@@ -125,16 +676,16 @@ class CertificateHandler(MountHelperBase):
     def get_current_time(self):
         return get_utc_now()
 
-    def check_ca_certs_validity(self, ca_cert=""):
+    # Warn when the CA cert expires soon, once per interval if fpath is set.
+    def check_ca_certs_validity(self, ca_cert="", fpath=None):
         assert self.is_loaded()
-        before = self.get_certificate_not_before_date()
         after = self.get_certificate_not_after_date()
 
-        diff = after - before
-        days = divmod(diff.total_seconds(), 60 * 60 * 24)
-
         alert_at = get_utc_date(after, days=-ALERT_CA_BEFORE)
-        if alert_at < self.get_current_time():
+        if alert_at < self.get_current_time() and (
+            not fpath
+            or CertCache().alert_due(fpath, ShareConfig(None).get_ca_alert_interval())
+        ):
             self.LogWarn(
                 ca_cert
                 + " CA certificate will be expired at: "
@@ -143,17 +694,16 @@ class CertificateHandler(MountHelperBase):
             )
         return True
 
+    # Hosts renew at their own point of the window before the latest renewal,
+    # so certs issued together are not renewed together.
     def get_cert_renewal_date(self):
         assert self.is_loaded()
-        before = self.get_certificate_not_before_date()
-        after = self.get_certificate_not_after_date()
-
-        diff = after - before
-        mins = divmod(diff.total_seconds(), 60)
-        renew_mins = mins[0] * CERT_VALID_LIFE_REMAINS
-
-        # we can renew cert from this date
-        can_renew_at = get_utc_date(after, minutes=-renew_mins)
+        not_before = self.get_certificate_not_before_date()
+        not_after = self.get_certificate_not_after_date()
+        latest = self.crypto_x509.renew_at or renewal_date(not_before, not_after)
+        window = ShareConfig(None).get_cert_renewal_window() / 100.0
+        spread = (not_after - not_before).total_seconds() * window * (1 - host_fraction())
+        can_renew_at = latest - timedelta(seconds=int(spread))
         self.LogDebug("Certificate will be renewed at: " + utc_format(can_renew_at))
         return can_renew_at
 
@@ -186,68 +736,34 @@ class CertificateHandler(MountHelperBase):
         return rdate
 
     def load_private_key(self, data):
-        try:
-            if not is_empty(data):
-                with TempFile(data) as key:
-                    if self.run_openssl(
-                        ["rsa", "-in", key.filename, "-check"], "LoadPrivateKey"
-                    ):
-                        return key
-        except Exception as ex:
-            self.LogException("LoadX509PrivateKey", ex)
-        return None
+        if is_empty(data):
+            return False
+        return self.crypto().check_private_key(data)
+
+    def get_key_type(self):
+        return ShareConfig(None).get_client_key_type()
+
+    # A key of a known type other than the configured one must be replaced.
+    def key_type_ok(self, private_key):
+        found = private_key_type(private_key)
+        wanted = self.get_key_type()
+        if found and found != wanted:
+            self.LogInfo("Client key type changed from %s to %s." % (found, wanted))
+            return False
+        return True
 
-    def generate_private_key(self):
-        with TempFile() as key:
-            out = self.run_openssl(
-                [
-                    "genpkey",
-                    "-algorithm",
-                    "RSA",
-                    "-out",
-                    key.filename,
-                    "-outform",
-                    "PEM",
-                    "-pkeyopt",
-                    "rsa_keygen_bits:" + str(RSA_KEY_LENGTH),
-                ],
-                "GenPrivateKey",
-            )
-            if out:
-                return key.read()
-        return None
+    def generate_private_key(self, key_type=None):
+        return self.crypto().generate_private_key(key_type or self.get_key_type())
 
     # a helper function to check csr is ok
     def validate_csr(self, csr_txt):
-        csr_txt = csr_txt.replace("\\n", "\n")
-        with TempFile(csr_txt) as csr:
-            cmd = ["req", "-in", csr.filename, "-text", "-noout", "-verify"]
-            out = self.run_openssl(cmd, "CheckCSR")
-            return out is not None
+        return self.crypto().validate_csr(csr_txt.replace("\\n", "\n"))
 
     def get_digest(self):
         return "-sha256"
 
     def generate_csr(self, private_key):
-        # openssl req -out server.csr -key server.key -new
-        digest = self.get_digest()
-        with TempFile(private_key) as key:
-            with TempFile() as csr:
-                cmd = [
-                    "req",
-                    "-nodes",
-                    digest,
-                    "-new",
-                    "-subj",
-                    OPENSSL_CSR_SUBJECT,
-                    "-out",
-                    csr.filename,
-                    "-key",
-                    key.filename,
-                ]
-                out = self.run_openssl(cmd, "GenCSR")
-                if out:
-                    csr_txt = csr.read()
-                    csr_txt = csr_txt.replace("\n", "\\n")
-                    return csr_txt
+        csr = self.crypto().generate_csr(private_key or "", self.get_digest())
+        if csr:
+            return csr.replace("\n", "\\n")
         return None
@@ -5,7 +5,6 @@
 # This project is licensed under the MIT License, see LICENSE file in the root directory.
 
 
-import copy
 import glob
 import os
 import re
@@ -13,12 +12,13 @@ import sys
 import socket
 import subprocess
 import shutil
-import tempfile
+import signal
+import threading
 import time
 import logging
-import logging.handlers
 from datetime import datetime, timezone, timedelta
 
+LOOPBACK_ADDRESS = "127.0.0.1"  # stunnel mounts are made through it
 
 def sleep_msg(secs, msg):
     print("Wait (" + str(secs) + " secs): " + msg)
@@ -31,9 +31,27 @@ def decode(val):
 
 
 def clone_obj(obj):
+    import copy
+
     return copy.deepcopy(obj)
 
 
+# The packaged launcher runs with -S, so site-packages are only added
+# when an optional third party module is actually needed.
+def import_optional(name):
+    import importlib
+
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        if not sys.flags.no_site:
+            raise
+    import site
+
+    site.main()
+    return importlib.import_module(name)
+
+
 def make_dirs(fpath, is_file=False):
     path = fpath
     if is_file:
@@ -112,6 +130,39 @@ def get_filename(name):
     return name
 
 
+def read_json_file(fpath):
+    import json
+
+    try:
+        with open(fpath, "r") as fd:
+            return json.load(fd)
+    except Exception:
+        return None
+
+
+# Write to a temporary file and rename so readers never see partial data.
+# The file has its mode before any data is written to it, and each writer,
+# thread or process, has its own temporary file.
+def write_json_file(fpath, data, chmod=0o600):
+    import json
+    import tempfile
+
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=os.path.basename(fpath) + ".", suffix=".tmp", dir=os.path.dirname(fpath)
+        )
+        with os.fdopen(fd, "w") as fp:
+            os.fchmod(fp.fileno(), chmod)  # exact mode, whatever the umask
+            json.dump(data, fp)
+        os.replace(tmp_path, fpath)
+        return True
+    except Exception:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return False
+
+
 def get_val_from_text(txt, what, all, comments=None):
     txt = txt.strip()
     for line in txt.split("\n"):
@@ -125,26 +176,6 @@ def get_val_from_text(txt, what, all, comments=None):
     return None
 
 
-class TempFile(object):
-    def __init__(self, data=None, delete=True):
-        self.tf = tempfile.NamedTemporaryFile(delete=delete, dir=LocalInstall.path())
-        self.filename = self.tf.name
-        self.data = data
-
-    def __enter__(self):
-        if self.data:
-            with open(self.filename, "w") as fd:
-                fd.write(self.data)
-        return self
-
-    def read(self):
-        with open(self.filename, "r") as fd:
-            return fd.read()
-
-    def __exit__(self, exception_type, exception_value, traceback):
-        pass
-
-
 class LocalInstall:
     ipsec_mgr_obj = None
 
@@ -246,6 +277,8 @@ class MountHelperLogger:
     def init_log_file(self):
         if not LocalInstall.exists():
             return None
+        import logging.handlers
+
         handler = logging.handlers.RotatingFileHandler(
             self.LOG_FILE, maxBytes=self.MAX_SIZE, backupCount=self.MAX_FILES
         )
@@ -324,14 +357,279 @@ class MountHelperLogger:
         self.LogError(msg, code=SysApp.ERR_PYTHON_EXCEPTION)
 
 
+class OperationDeadline(object):
+    """Wall clock budget shared by every command run for one operation."""
+
+    DEFAULT_SECS = 600
+    current = None
+
+    def __init__(self, secs):
+        self.secs = secs
+        self.expires = time.monotonic() + secs
+        self.outer = None
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def __enter__(self):
+        OperationDeadline.current = self
+        return self
+
+    def __exit__(self, *args):
+        OperationDeadline.current = self.outer
+
+    # Own budget for one attempt of a retried step, used as a with block.
+    # The deadline of the operation is back in effect after it.
+    @staticmethod
+    def nested(secs=DEFAULT_SECS):
+        op = OperationDeadline(secs)
+        op.outer = OperationDeadline.current
+        return op
+
+    @staticmethod
+    def start(secs=DEFAULT_SECS):
+        OperationDeadline.current = OperationDeadline(secs)
+        return OperationDeadline.current
+
+    @staticmethod
+    def clear():
+        OperationDeadline.current = None
+
+    # Per command timeout, capped by what is left of the operation.
+    @staticmethod
+    def limit(timeout):
+        op = OperationDeadline.current
+        if op is None:
+            return timeout
+        if timeout is None:
+            return op.remaining()
+        return min(timeout, op.remaining())
+
+
+class RetryPolicy(object):
+    """Capped exponential backoff with full jitter and a total deadline.
+
+    The wait before retry n is random in [0, min(cap, base * 2 ** (n - 1))],
+    so hosts that failed at the same time do not retry at the same time.
+    A policy with attempts < 0 never gives up, it waits up to the cap after
+    errors that are not retryable. A deadline of 0 has no deadline. The
+    OperationDeadline only bounds each attempt, never the policy.
+    """
+
+    RETRY_STATUS = [408, 425, 429]
+
+    def __init__(self, base, cap, attempts=-1, deadline=0):
+        self.base = base
+        self.cap = cap
+        self.attempts = attempts
+        self.tries = 0
+        self.expires = time.monotonic() + deadline if deadline > 0 else None
+
+    # No response at all (timeout, refused), throttling and server errors.
+    @staticmethod
+    def is_retryable(status):
+        return status is None or status in RetryPolicy.RETRY_STATUS or status >= 500
+
+    # Seconds to wait before the next attempt, None to give up.
+    def next_delay(self, retryable=True):
+        import random
+
+        self.tries += 1
+        if self.attempts >= 0 and (self.tries >= self.attempts or not retryable):
+            return None
+        ceiling = self.cap
+        if retryable:
+            ceiling = min(self.cap, self.base * 2 ** min(self.tries - 1, 32))
+        delay = random.uniform(0, ceiling)
+        if self.expires is not None:
+            left = self.expires - time.monotonic()
+            if left <= 0:
+                return None
+            delay = min(delay, left)
+        return delay
+
+
+class TraceSpan(object):
+    def __init__(self, name, parent):
+        self.name = parent.name + "/" + name if parent and parent.parent else name
+        self.parent = parent
+        self.span_id = "%016x" % (id(self) & 0xFFFFFFFFFFFFFFFF)
+        self.start = time.monotonic()
+        self.end = None
+        self.forks = 0
+
+    def duration(self):
+        end = self.end if self.end is not None else time.monotonic()
+        return end - self.start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        Tracer.end(self)
+
+
+class Tracer(MountHelperLogger):
+    """Nested timing spans for one run of the helper.
+
+    Spans are kept per thread so concurrent mounts nest under the root span.
+    The summary is one key=value line in the log file. When share.conf has a
+    trace_file entry each run is also appended to it as one OTLP JSON line.
+    """
+
+    MAX_TRACE_FILE_SIZE = 1024 * 1024
+    root = None
+    spans = []
+    local = threading.local()
+    lock = threading.Lock()
+    wall_start = 0.0
+
+    @staticmethod
+    def stack():
+        if not hasattr(Tracer.local, "stack"):
+            Tracer.local.stack = []
+        return Tracer.local.stack
+
+    @staticmethod
+    def start(name):
+        Tracer.local = threading.local()
+        Tracer.wall_start = time.time()
+        Tracer.root = TraceSpan(name, None)
+        Tracer.spans = [Tracer.root]
+        return Tracer.root
+
+    @staticmethod
+    def span(name):
+        if not Tracer.root:
+            return TraceSpan(name, None)  # not tracing, nothing recorded
+        stack = Tracer.stack()
+        span = TraceSpan(name, stack[-1] if stack else Tracer.root)
+        with Tracer.lock:
+            Tracer.spans.append(span)
+        stack.append(span)
+        return span
+
+    @staticmethod
+    def end(span):
+        span.end = time.monotonic()
+        stack = Tracer.stack()
+        if span in stack:
+            del stack[stack.index(span) :]
+
+    # Forks count towards every open span of the calling thread.
+    @staticmethod
+    def add_fork():
+        stack = Tracer.stack()
+        span = stack[-1] if stack else Tracer.root
+        with Tracer.lock:
+            while span:
+                span.forks += 1
+                span = span.parent
+
+    def summary(self):
+        root = Tracer.root
+        items = ["trace=%s" % root.name, "total=%.3fs" % root.duration()]
+        items.append("forks=%d" % root.forks)
+        for span in Tracer.spans[1:]:
+            items.append("%s=%.3fs:%d" % (span.name, span.duration(), span.forks))
+        return " ".join(items)
+
+    def to_otlp(self, trace_id):
+        def nanos(mono):
+            return int((Tracer.wall_start + mono - Tracer.root.start) * 1e9)
+
+        spans = []
+        for span in Tracer.spans:
+            item = {
+                "traceId": trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "startTimeUnixNano": nanos(span.start),
+                "endTimeUnixNano": nanos(span.start + span.duration()),
+                "attributes": [{"key": "process.forks", "value": {"intValue": span.forks}}],
+            }
+            if span.parent:
+                item["parentSpanId"] = span.parent.span_id
+            spans.append(item)
+        service = {"key": "service.name", "value": {"stringValue": "mount.ibmshare"}}
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [service]},
+                    "scopeSpans": [{"scope": {"name": "mount.ibmshare"}, "spans": spans}],
+                }
+            ]
+        }
+
+    def finish(self, trace_file=None):
+        if not Tracer.root:
+            return None
+        Tracer.end(Tracer.root)
+        line = self.summary()
+        self.LogDebug(line)
+        self.log_to_file(logging.INFO, line)
+        if trace_file:
+            self.write_trace(trace_file)
+        Tracer.root = None
+        return line
+
+    def write_trace(self, trace_file):
+        import json
+
+        trace_id = "%032x" % int(Tracer.wall_start * 1e9)
+        try:
+            if os.path.getsize(trace_file) > Tracer.MAX_TRACE_FILE_SIZE:
+                os.replace(trace_file, trace_file + ".1")
+        except OSError:
+            pass  # no trace file yet
+        try:
+            with open(trace_file, "a") as fd:
+                fd.write(json.dumps(self.to_otlp(trace_id)) + "\n")
+        except Exception as ex:
+            self.LogException("WriteTrace", ex, trace_file)
+
+
+# Decorator recording each call of a method as a trace span.
+def traced(name):
+    def wrap(func):
+        def run(*args, **kwargs):
+            with Tracer.span(name):
+                return func(*args, **kwargs)
+
+        run.__name__ = func.__name__
+        run.__doc__ = func.__doc__
+        run.__wrapped__ = func
+        return run
+
+    return wrap
+
+
 class SubProcess(MountHelperLogger):
-    def __init__(self, cmd):
+    DEFAULT_TIMEOUT = 120
+    TIMEOUT_CODE = 124  # same as coreutils timeout
+    KILL_WAIT = 5
+    spawned = 0
+    spawn_lock = threading.Lock()
+
+    def __init__(self, cmd, timeout=DEFAULT_TIMEOUT, stdin=None, env=None):
         if isinstance(cmd, str):
             cmd = cmd.split()
         assert isinstance(cmd, list)
         self.cmd = cmd
+        self.timeout = timeout
+        self.stdin = stdin  # text passed over a pipe, eg key material
+        self.env = env
+        self.elapsed = 0.0
+        self.timed_out = False
         self.set_output(-1, None, None)
 
+    @staticmethod
+    def count_spawn():
+        with SubProcess.spawn_lock:
+            SubProcess.spawned += 1
+        if Tracer.root:
+            Tracer.add_fork()
+
     def set_output(self, ret, stdout, stderr):
         self.returncode = ret
         self.stderr = decode(stderr)
@@ -372,6 +670,7 @@ class SubProcess(MountHelperLogger):
     def stream(self):
         try:
             self.LogDebug("Stream: " + self.cmd_to_str())
+            SubProcess.count_spawn()
             with subprocess.Popen(
                 # self.cmd_to_str(),
                 self.cmd,
@@ -391,16 +690,46 @@ class SubProcess(MountHelperLogger):
             self.LogException(ex, "Stream")
         return None
 
-    def run(self):
-        if sys.version_info[:2] < (3, 5):
-            proc = subprocess.Popen(
-                self.cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            (stdout, stderr) = proc.communicate()
-            return self.set_output(proc.returncode, stdout, stderr)
+    # Kill the whole process group, mount.nfs and friends fork helpers.
+    def kill(self, proc):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            proc.kill()
+        try:
+            return proc.communicate(timeout=self.KILL_WAIT)
+        except subprocess.TimeoutExpired:
+            return b"", b""  # a daemonized child still holds the pipes
 
-        out = subprocess.run(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return self.set_output(out.returncode, out.stdout, out.stderr)
+    def run(self):
+        timeout = OperationDeadline.limit(self.timeout)
+        if timeout is not None and timeout <= 0:
+            self.timed_out = True
+            msg = b"Operation deadline expired, command not run"
+            return self.set_output(self.TIMEOUT_CODE, None, msg)
+
+        start = time.monotonic()
+        SubProcess.count_spawn()
+        proc = subprocess.Popen(
+            self.cmd,
+            stdin=None if self.stdin is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+            env=self.env,
+        )
+        data = None if self.stdin is None else self.stdin.encode("utf-8")
+        try:
+            stdout, stderr = proc.communicate(input=data, timeout=timeout)
+            ret = proc.returncode
+        except subprocess.TimeoutExpired:
+            stdout, stderr = self.kill(proc)
+            self.timed_out = True
+            ret = self.TIMEOUT_CODE
+            msg = "Command timed out after %gs" % timeout
+            stderr = (decode(stderr) + "\n" + msg).encode("utf-8")
+        self.elapsed = time.monotonic() - start
+        return self.set_output(ret, stdout, stderr)
 
 
 class MountHelperBase(MountHelperLogger):
@@ -483,12 +812,20 @@ class MountHelperBase(MountHelperLogger):
             return old_data == data
         return False
 
-    def RunSilent(self, cmd):
-        out = SubProcess(cmd).run()
+    def RunSilent(self, cmd, timeout=SubProcess.DEFAULT_TIMEOUT):
+        out = SubProcess(cmd, timeout).run()
         return out
 
-    def RunCmd(self, cmd, descr, ret_out=False):
-        proc = SubProcess(cmd)
+    def RunCmd(
+        self,
+        cmd,
+        descr,
+        ret_out=False,
+        timeout=SubProcess.DEFAULT_TIMEOUT,
+        stdin=None,
+        env=None,
+    ):
+        proc = SubProcess(cmd, timeout, stdin=stdin, env=env)
 
         try:
             msg = proc.cmd_to_str()
@@ -496,6 +833,7 @@ class MountHelperBase(MountHelperLogger):
                 msg = "%s (%s)" % (descr, msg)
             self.LogDebug("RunCmd: " + msg)
             output = proc.run()
+            self.LogDebug("RunCmd: %s took %.3fs" % (descr, proc.elapsed))
             if output.is_error():
                 self.LogError(output.get_error())
                 if ret_out:
@@ -511,10 +849,27 @@ class MountHelperBase(MountHelperLogger):
             
         return None
 
+    # Run independent commands concurrently, one RunCmd result per command.
+    def RunCmds(self, cmds, descr, timeout=SubProcess.DEFAULT_TIMEOUT):
+        outputs = [None] * len(cmds)
+
+        def run(ndx):
+            outputs[ndx] = self.RunCmd(cmds[ndx], descr, timeout=timeout)
+
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(len(cmds))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outputs
+
 class SystemCtl(MountHelperBase):
     EXE_PATH = "/bin/systemctl"
+    CMD_TIMEOUT = 90
     OS_PATH = "/etc/os-release"
     SYSTEMD_VERSION_SUPPORTS_UTC = 228
+    DPKG_STATUS = "/var/lib/dpkg/status"
+    RPM_PATH = "/usr/bin/rpm"
 
     def __init__(self, name):
         self.name = name
@@ -556,27 +911,30 @@ class SystemCtl(MountHelperBase):
         return self.systemd_version() >= self.SYSTEMD_VERSION_SUPPORTS_UTC
 
     def systemd_version(self):
-        version = get_app_version(self.EXE_PATH, "systemd")
+        version = PlatformCaps().get(
+            "systemd_version",
+            lambda: get_app_version(self.EXE_PATH, "systemd"),
+            [self.EXE_PATH],
+        )
         return to_int(version) if version else 0
 
+    def read_os_release(self):
+        if not self.FileExists(self.OS_PATH):
+            return None
+        content = self.ReadFile(self.OS_PATH, log=False)
+        return dict(re.findall(r'^(\w+)="([^"]*)"', content, re.MULTILINE))
+
+    def os_release(self):
+        return PlatformCaps().get("os_release", self.read_os_release, [self.OS_PATH]) or {}
+
     def get_os_version(self):
-        if self.FileExists(self.OS_PATH):
-            content = self.ReadFile(self.OS_PATH, log=False)
-            match = re.search(r'^VERSION_ID="([^"]+)"', content, re.MULTILINE)
-            return match.group(1)
+        return self.os_release().get("VERSION_ID")
 
     def get_os_name(self):
-        if self.FileExists(self.OS_PATH):
-            content = self.ReadFile(self.OS_PATH, log=False)
-            match = re.search(r'^NAME="([^"]*)"', content, re.MULTILINE)
-            return match.group(1)
+        return self.os_release().get("NAME")
 
     def is_kernel_version_6_or_higher(self):
-        result = subprocess.run(
-            ["uname", "-r"], capture_output=True, text=True, check=True
-        )
-        version = result.stdout.strip()
-        major_version = int(version.split(".")[0])
+        major_version = int(os.uname().release.split(".")[0])
         return major_version >= 6
 
     def check_tls_enabled_os(self, os_list):
@@ -587,18 +945,54 @@ class SystemCtl(MountHelperBase):
         return enabled in os_list
 
     def tls_package_installed(self, package_name):
-        os_name = self.get_os_name()
-        if os_name == "Ubuntu":
-            # For Ubuntu and Debian-based systems
-            command = ["dpkg", "-l"]
-            output = subprocess.check_output(command).decode()
-            return package_name in output
-        elif os_name in ["Red Hat Enterprise Linux", "Rocky Linux"]:
-            # For RHEL, CentOS, and Rocky Linux
-            command = ["rpm", "-qa"]
-            output = subprocess.check_output(command).decode().strip()
-            return package_name in output
-        return "not installed" not in output
+        return self.packages_installed([package_name])[package_name]
+
+    # Answer for all names in one pass, cached until the package db changes.
+    def packages_installed(self, names):
+        names = sorted(set(names))
+        installed = PlatformCaps().get(
+            "packages:" + ",".join(names),
+            lambda: self.query_packages(names),
+            [self.DPKG_STATUS, self.RPM_PATH],
+        )
+        installed = installed or []
+        return {name: name in installed for name in names}
+
+    def query_packages(self, names):
+        if os.path.exists(self.DPKG_STATUS):
+            return self.query_dpkg(names)
+        if os.path.exists(self.RPM_PATH):
+            return self.query_rpm(names)
+        self.LogWarn("No dpkg or rpm package database found.")
+        return None
+
+    # Scan the dpkg status file, only whole package names in installed state count.
+    def query_dpkg(self, names):
+        wanted = set(names)
+        installed = set()
+        package = None
+        try:
+            with open(self.DPKG_STATUS, encoding="utf-8", errors="replace") as fd:
+                for line in fd:
+                    if line.startswith("Package:"):
+                        package = line[8:].strip()
+                    elif line.startswith("Status:") and package in wanted:
+                        if line.split()[-1] == "installed":
+                            installed.add(package)
+                    elif not line.strip():
+                        package = None
+        except OSError as ex:
+            self.LogError("Could not read %s: %s" % (self.DPKG_STATUS, str(ex)))
+            return None
+        return sorted(installed)
+
+    def query_rpm(self, names):
+        out = SubProcess([self.RPM_PATH, "-q", "--qf", "%{NAME}\n"] + names).run()
+        if out.timed_out:
+            self.LogError(out.get_error())
+            return None
+        # missing packages are reported on stdout and make rpm exit non zero
+        return sorted(set(out.stdout.splitlines()) & set(names))
 
     def action(self, action, arg=None, silent=False):
         cmd = [self.EXE_PATH, action]
@@ -606,8 +1000,187 @@ class SystemCtl(MountHelperBase):
             cmd.append(arg)
         cmd.append(self.name)
         if silent:
-            return self.RunSilent(cmd)
-        return self.RunCmd(cmd, "")
+            return self.RunSilent(cmd, self.CMD_TIMEOUT)
+        return self.RunCmd(cmd, "", timeout=self.CMD_TIMEOUT)
+
+
+class JsonStateCache(MountHelperBase):
+    """Dict kept in a json state file and loaded once per process.
+
+    Each subclass sets CACHE_FILE and shares the dict through its cache class
+    attribute. Nothing is written unless the mount helper is installed.
+    """
+
+    CACHE_FILE = None
+    CACHE_MODE = 0o600
+    cache = None
+
+    def load_cache(self):
+        cls = type(self)
+        if cls.cache is None:
+            data = read_json_file(cls.CACHE_FILE)
+            cls.cache = data if isinstance(data, dict) else {}
+        return cls.cache
+
+    def save_cache(self, data=None):
+        cls = type(self)
+        if LocalInstall.exists():
+            data = cls.cache if data is None else data
+            write_json_file(cls.CACHE_FILE, data, chmod=cls.CACHE_MODE)
+
+
+class NameResolver(JsonStateCache):
+    """Host name resolution with a lookup deadline and a short lived cache."""
+
+    CACHE_FILE = LocalInstall.make_filename("resolver-cache.json")
+    CACHE_TTL_SECS = 60
+    LOOKUP_TIMEOUT_SECS = 5
+    MAX_WORKERS = 8
+    cache = None
+
+    @staticmethod
+    def is_ip_address(host):
+        try:
+            socket.inet_pton(socket.AF_INET, host)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def save_cache(self):
+        now = time.time()
+        live = {}
+        for host, entry in NameResolver.cache.items():
+            if entry[1] > now:
+                live[host] = entry
+        super().save_cache(live)
+
+    # Live cache entry [ip, expires], the ip is None for a failed lookup.
+    def cached(self, host):
+        entry = self.load_cache().get(host)
+        if entry and entry[1] > time.time():
+            return entry
+        return None
+
+    def resolve(self, host):
+        return self.resolve_all([host]).get(host)
+
+    # Resolve many hosts at once, literal addresses and cache hits need no lookup.
+    def resolve_all(self, hosts):
+        results = {}
+        pending = []
+        for host in hosts:
+            if not host or host in results or host in pending:
+                continue
+            if NameResolver.is_ip_address(host):
+                results[host] = host
+                continue
+            entry = self.cached(host)
+            if entry:
+                results[host] = entry[0]
+            else:
+                pending.append(host)
+
+        if pending:
+            # one deadline for all lookups, failed lookups are cached as well
+            # so the per mount line lookups do not wait for them again. Hosts
+            # left over when the deadline passed are not cached.
+            deadline = time.monotonic() + NameResolver.LOOKUP_TIMEOUT_SECS
+            expires = time.time() + NameResolver.CACHE_TTL_SECS
+            for pos in range(0, len(pending), NameResolver.MAX_WORKERS):
+                batch = pending[pos : pos + NameResolver.MAX_WORKERS]
+                for host, ip in self.lookup(batch, deadline).items():
+                    results[host] = ip
+                    NameResolver.cache[host] = [ip, expires]
+            for host in pending:
+                results.setdefault(host, None)
+            self.save_cache()
+        return results
+
+    # getaddrinfo has no timeout, so each lookup runs in a daemon thread
+    # that is abandoned once the deadline passes. Returns nothing when the
+    # deadline passed before the lookups could start.
+    def lookup(self, hosts, deadline):
+        results = {}
+        if time.monotonic() >= deadline:
+            return results
+
+        def worker(host):
+            try:
+                infos = socket.getaddrinfo(
+                    host, None, socket.AF_INET, socket.SOCK_STREAM
+                )
+                results[host] = infos[0][4][0]
+            except Exception as ex:
+                self.LogDebug("Resolve %s failed: %s" % (host, str(ex)))
+
+        threads = []
+        for host in hosts:
+            thread = threading.Thread(target=worker, args=(host,), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+        out = {}
+        for host in hosts:
+            out[host] = results.get(host)
+            if not out[host]:
+                self.LogDebug("Could not resolve host: " + host)
+        return out
+
+
+class PlatformCaps(JsonStateCache):
+    """Host facts that only change on reboot or package install.
+
+    Facts are kept in CACHE_FILE together with the boot id and the mtimes of
+    the paths they were probed from and of the package databases, a fact is
+    probed again when any of them changed. Failed probes (None) are not kept.
+    """
+
+    CACHE_FILE = LocalInstall.make_filename("platform-caps.json")
+    CACHE_MODE = 0o644
+    BOOT_ID_FILE = "/proc/sys/kernel/random/boot_id"
+    PACKAGE_DBS = [
+        "/var/lib/dpkg/status",
+        "/var/lib/rpm/rpmdb.sqlite",
+        "/var/lib/rpm/Packages",
+        "/usr/lib/sysimage/rpm/rpmdb.sqlite",
+    ]
+    cache = None
+
+    @staticmethod
+    def mtime(fpath):
+        try:
+            return os.stat(fpath).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def boot_id():
+        try:
+            with open(PlatformCaps.BOOT_ID_FILE) as fd:
+                return fd.read().strip()
+        except OSError:
+            return None
+
+    def make_key(self, paths):
+        key = [PlatformCaps.boot_id()]
+        for fpath in list(paths) + PlatformCaps.PACKAGE_DBS:
+            key.append(PlatformCaps.mtime(fpath))
+        return key
+
+    # Return the fact called name, probe() is only run if the cached value is stale.
+    def get(self, name, probe, paths=()):
+        key = self.make_key(paths)
+        entry = self.load_cache().get(name)
+        if isinstance(entry, list) and len(entry) == 2 and entry[0] == key:
+            return entry[1]
+        value = probe()
+        if value is not None:
+            PlatformCaps.cache[name] = [key, value]
+            self.save_cache()
+        return value
 
 
 class NfsMount(MountHelperBase):
@@ -620,27 +1193,111 @@ class NfsMount(MountHelperBase):
     PATH_INDEX = 1
     SOURCE_ARGS_LENGTH = 2
     MOUNT_LIST_NFS_CMD = ["mount", "-t nfs,nfs4"]
-
-    def __init__(self, ip=None, mount_path=None, mounted_at=None, mount_port=None):
+    MOUNTINFO_FILE = "/proc/self/mountinfo"
+    # mountinfo fields before the optional fields and the "-" separator
+    MOUNTINFO_MIN_FIELDS = 6
+    MOUNTINFO_MOUNTED_AT = 4
+    MOUNTINFO_OPTIONS = 5
+
+    def __init__(
+        self, ip=None, mount_path=None, mounted_at=None, mount_port=None, options=None
+    ):
         self.ip = ip
         self.mount_path = mount_path
         self.mounted_at = mounted_at
         self.mount_port = mount_port
+        self.options = options
 
     def load_nfs_mounts(self):
+        mounts = self.load_mountinfo()
+        if mounts is None:
+            mounts = self.load_mount_cmd()
+
+        self.LogDebug("Existing nfs/nfs4 mounts found:" + str(len(mounts)))
+        return mounts
+
+    # Read the kernel mount table directly, no fork and no name resolution
+    # when the kernel recorded the server address (addr= option).
+    def load_mountinfo(self):
+        try:
+            with open(NfsMount.MOUNTINFO_FILE, "r") as fd:
+                lines = fd.read().splitlines()
+        except Exception as ex:
+            self.LogDebug("Mountinfo not readable, using mount command: " + str(ex))
+            return None
+
+        # only entries without a kernel recorded addr= need a lookup
+        hosts = []
+        for line in lines:
+            fields = NfsMount.get_mountinfo_fields(line)
+            if fields and "addr=" not in fields[2]:
+                hosts.append(NfsMount.split_source(fields[1])[0])
+        NameResolver().resolve_all(hosts)
+
+        mounts = []
+        for line in lines:
+            mount = self.get_mountinfo_mount(line)
+            if mount:
+                mounts.append(mount)
+        return mounts
+
+    # Returns (mount fields, source, super options) of a nfs/nfs4 entry.
+    @staticmethod
+    def get_mountinfo_fields(line):
+        # 36 25 0:44 / /mnt rw,relatime shared:1 - nfs4 1.1.1.1:/path rw,vers=4.1,addr=1.1.1.1
+        fields = line.split(" ")
+        if "-" not in fields:
+            return None
+        sep = fields.index("-")
+        if sep < NfsMount.MOUNTINFO_MIN_FIELDS or len(fields) < sep + 4:
+            return None
+        if fields[sep + 1] not in [NfsMount.MOUNT_TYPE_NFS, NfsMount.MOUNT_TYPE_NFS4]:
+            return None
+        return fields[:sep], NfsMount.unescape(fields[sep + 2]), fields[sep + 3]
+
+    def get_mountinfo_mount(self, line):
+        nfs_fields = NfsMount.get_mountinfo_fields(line)
+        if not nfs_fields:
+            return None
+
+        fields, source, super_options = nfs_fields
+        options = fields[NfsMount.MOUNTINFO_OPTIONS] + "," + super_options
+        host, mount_path = NfsMount.split_source(source)
+        ip = NfsMount.get_option(options, "addr")
+        if not ip and host:
+            ip, _ = NfsMount.extract_source(source)
+        if ip and mount_path:
+            return NfsMount(
+                ip,
+                mount_path,
+                NfsMount.unescape(fields[NfsMount.MOUNTINFO_MOUNTED_AT]),
+                NfsMount.get_option(options, "port"),
+                options,
+            )
+        return None
+
+    # Fallback for environments without a readable mountinfo.
+    def load_mount_cmd(self):
         result = self.RunCmd(NfsMount.MOUNT_LIST_NFS_CMD, "ListNfsMounts")
         if not result:
             return []
 
         lines = result.stdout.splitlines()
+        hosts = []
+        for line in lines:
+            mount_fields = line.split(" ")
+            if len(mount_fields) >= NfsMount.MOUNT_OUTPUT_FIELDS_SIZE:
+                host, _ = NfsMount.split_source(mount_fields[NfsMount.NFS_PATH_INDEX])
+                hosts.append(host)
+        # resolve all hosts concurrently, the per line lookups then hit the cache
+        NameResolver().resolve_all(hosts)
+
         mounts = []
         # Parse mount command output line by line and search for ip address and mount path.
         for line in lines:
             mount = self.get_nfs_mount(line)
             if mount:
                 mounts.append(mount)
-
-        self.LogDebug("Existing nfs/nfs4 mounts found:" + str(len(mounts)))
         return mounts
 
     def get_nfs_mount(self, line):
@@ -666,20 +1323,92 @@ class NfsMount(MountHelperBase):
             return match.group(1)
         return None
 
+    @staticmethod
+    def get_option(options, name):
+        for option in options.split(","):
+            if option.startswith(name + "="):
+                return option[len(name) + 1 :]
+        return None
+
+    # mountinfo escapes space, tab, newline and backslash as octal
+    @staticmethod
+    def unescape(val):
+        return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), val)
+
+    @staticmethod
+    def split_source(src):
+        host_path = src.split(":")
+        if len(host_path) >= NfsMount.SOURCE_ARGS_LENGTH:
+            return host_path[NfsMount.HOST_INDEX], host_path[NfsMount.PATH_INDEX]
+        return None, None
+
     @staticmethod
     def extract_source(src):
         if len(src) > 0:
             host_path = src.split(":")
             if len(host_path) >= NfsMount.SOURCE_ARGS_LENGTH:
                 mount_path = host_path[NfsMount.PATH_INDEX]
-                try:
-                    ip = socket.gethostbyname(host_path[NfsMount.HOST_INDEX])
+                ip = NameResolver().resolve(host_path[NfsMount.HOST_INDEX])
+                if ip:
                     return ip, mount_path
-                except:
-                    pass
         return None, None
 
 
+class MountTable(object):
+    """Nfs mounts indexed by (ip, path, port) for constant time lookups."""
+
+    # snapshot shared by every consumer in this invocation
+    current = None
+
+    def __init__(self, mounts=None):
+        self.mounts = []
+        self.by_port = {}
+        self.by_path = {}
+        self.by_ip = {}
+        self.by_mounted_at = {}
+        for mount in mounts if mounts else []:
+            self.add(mount)
+
+    @staticmethod
+    def load():
+        return MountTable(NfsMount().load_nfs_mounts())
+
+    @staticmethod
+    def snapshot():
+        if MountTable.current is None:
+            MountTable.current = MountTable.load()
+        return MountTable.current
+
+    # Call after our own mount/umount so the next lookup re-reads the table.
+    @staticmethod
+    def invalidate():
+        MountTable.current = None
+
+    def add(self, mount):
+        self.mounts.append(mount)
+        self.by_port.setdefault((mount.ip, mount.mount_path, mount.mount_port), mount)
+        self.by_path.setdefault((mount.ip, mount.mount_path), mount)
+        self.by_ip.setdefault(mount.ip, mount)
+        self.by_mounted_at.setdefault(mount.mounted_at, mount)
+
+    def is_mounted(self, ip, mount_path, port=""):
+        if port == "":
+            return (ip, mount_path) in self.by_path
+        return (ip, mount_path, port) in self.by_port
+
+    def has_ip(self, ip):
+        return ip in self.by_ip
+
+    def get_mounted_at(self, mount_point):
+        return self.by_mounted_at.get(mount_point)
+
+    def __len__(self):
+        return len(self.mounts)
+
+    def __iter__(self):
+        return iter(self.mounts)
+
+
 def extract_version(ver):
     str = ""
     for a in trim(ver):
@@ -766,6 +1495,99 @@ class RootCert(object):
         files.sort(key=get_key)
 
 
+def no_spaces(val):
+    return val.replace(" ", "")
+
+
+CLIENT_KEY_TYPES = ["rsa2048", "rsa3072", "rsa4096", "ecdsa-p256", "ecdsa-p384"]
+
+
+def key_type(val):
+    val = val.lower()
+    if val not in CLIENT_KEY_TYPES:
+        raise ValueError(val)
+    return val
+
+
+class ShareSettings(MountHelperLogger):
+    """Typed values of a share.conf file, parsed once per file change.
+
+    The values are cached per path and keyed on the inode, mtime and size of
+    the file, so repeated lookups on the mount and renewal paths only stat
+    it. Keys match without case, the first entry wins. A missing or invalid
+    value gives the default of the key, unknown keys are kept as text.
+    """
+
+    # key: (type, default, min, max)
+    KEYS = {
+        "region": (no_spaces, None, None, None),
+        "certificate_duration_seconds": (int, 3600, 300, 3600),
+        "metadata_retry_count": (int, 25, 1, None),
+        "metadata_retry_interval": (int, 60, 0, None),
+        "metadata_retry_max_interval": (int, 300, 0, None),
+        "metadata_retry_deadline_seconds": (int, 1800, 0, None),
+        "trace_file": (str, None, None, None),
+        "metrics_textfile_dir": (str, None, None, None),
+        "trusted_root_cacert": (str, None, None, None),
+        "stunnel_env": (str, None, None, None),
+        "ca_alert_interval_seconds": (int, 86400, 0, None),
+        "cert_renewal_window_percent": (int, 20, 0, 60),
+        "client_key_type": (key_type, "rsa4096", None, None),
+    }
+    cache = {}  # path: (stat key, values)
+    lock = threading.Lock()
+
+    def convert(self, name, val):
+        vtype, default, vmin, vmax = ShareSettings.KEYS[name]
+        if val is None:
+            return default
+        try:
+            val = vtype(val)
+        except ValueError:
+            self.LogWarn("Invalid %s=%s in share.conf, using %s" % (name, val, default))
+            return default
+        if (vmin is not None and val < vmin) or (vmax is not None and val > vmax):
+            self.LogWarn("Out of range %s=%s in share.conf, using %s" % (name, val, default))
+            return default
+        return val
+
+    def parse(self, data):
+        found = {}
+        for line in data.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            name, val = line.split("=", 1)
+            found.setdefault(name.strip().lower(), val.strip())
+        values = dict(found)
+        for name in ShareSettings.KEYS:
+            values[name] = self.convert(name, found.get(name))
+        return values
+
+    # Returns the values, None if the file can not be read.
+    def load(self, fpath):
+        try:
+            st = os.stat(fpath)
+            key = (st.st_ino, st.st_mtime_ns, st.st_size)
+            with ShareSettings.lock:
+                cached = ShareSettings.cache.get(fpath)
+            if cached and cached[0] == key:
+                return cached[1]
+            with open(fpath, "r") as fd:
+                values = self.parse(fd.read())
+        except OSError:
+            ShareSettings.forget(fpath)
+            return None
+        with ShareSettings.lock:
+            ShareSettings.cache[fpath] = (key, values)
+        return values
+
+    @staticmethod
+    def forget(fpath):
+        with ShareSettings.lock:
+            ShareSettings.cache.pop(fpath, None)
+
+
 class ShareConfig(ConfigEditor):
     conf_path = "/etc/ibmcloud"
 
@@ -775,6 +1597,19 @@ class ShareConfig(ConfigEditor):
         self.cert_path = cert_path
         self.show_error = show_error
 
+    def write(self):
+        ShareSettings.forget(self.name)
+        return super().write()
+
+    def settings(self):
+        return ShareSettings().load(self.name) or {}
+
+    def get_setting(self, name):
+        values = self.settings()
+        if name in ShareSettings.KEYS and name not in values:
+            return ShareSettings.KEYS[name][1]  # no file, use default
+        return values.get(name)
+
     def load_files(self):
         pfx = "type_ibmshare_root_"
         files = get_files_in_folder(self.cert_path, pfx + "*.*")
@@ -816,24 +1651,37 @@ class ShareConfig(ConfigEditor):
         return None
 
     def get_region(self):
-        if self.read():
-            return self.get_val("region")
-        return None
+        return self.get_setting("region")
 
     def get_certificate_duration(self):
-        if self.read():
-            return self.get_val("certificate_duration_seconds", False)
-        return None
+        return self.get_setting("certificate_duration_seconds")
 
     def get_metadata_retry_count(self):
-        if self.read():
-            return self.get_val("metadata_retry_count", False)
-        return None
+        return self.get_setting("metadata_retry_count")
 
     def get_metadata_retry_interval(self):
-        if self.read():
-            return self.get_val("metadata_retry_interval", False)
-        return None
+        return self.get_setting("metadata_retry_interval")
+
+    def get_metadata_retry_max_interval(self):
+        return self.get_setting("metadata_retry_max_interval")
+
+    def get_metadata_retry_deadline(self):
+        return self.get_setting("metadata_retry_deadline_seconds")
+
+    def get_trace_file(self):
+        return self.get_setting("trace_file")
+
+    def get_metrics_dir(self):
+        return self.get_setting("metrics_textfile_dir")
+
+    def get_ca_alert_interval(self):
+        return self.get_setting("ca_alert_interval_seconds")
+
+    def get_cert_renewal_window(self):
+        return self.get_setting("cert_renewal_window_percent")
+
+    def get_client_key_type(self):
+        return self.get_setting("client_key_type")
 
     def load_regions(self):
         regions = self.get_region()
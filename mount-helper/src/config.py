@@ -10,10 +10,12 @@ import os
 import shutil
 from datetime import datetime
 from common import *
+from metrics import Metrics
 
 
 class IpsecConfigBase(MountHelperBase):
     CLEANUP_FILE_MIN_AGE_MINS = 60
+    CMD_TIMEOUT = 60
     VERSION = None
 
     def __init__(self):
@@ -116,10 +118,14 @@ class IpsecConfigBase(MountHelperBase):
         return False
 
     # Remove any unused config files
+    @traced("ipsec_cleanup")
     def cleanup_unused_configs(self, mounts, age=None):
         if mounts is None:
-            mounts = NfsMount().load_nfs_mounts()
+            mounts = MountTable.snapshot()
+        elif not isinstance(mounts, MountTable):
+            mounts = MountTable(mounts)
 
+        done = Metrics.timed("ibmshare_cleanup", {"kind": "ipsec"})
         cfg_path, cfg_prefix, cfg_postfix = self.get_config_file_parts()
 
         def file_created_recently(fname, max_mins):
@@ -151,12 +157,7 @@ class IpsecConfigBase(MountHelperBase):
             file_ip = get_filename_ip(file)
             if not file_ip:
                 continue
-            got = False
-            for mount in mounts:
-                if mount.ip == file_ip:
-                    got = True
-                    break
-            if got:
+            if mounts.has_ip(file_ip):
                 inc_cnt(1)
             else:
                 fname = make_filename(cfg_path, file)
@@ -178,9 +179,11 @@ class IpsecConfigBase(MountHelperBase):
             cnts[3],
         )
         self.LogDebug(msg)
+        done()
         hasActiveMounts = cnts[1] != 0 or cnts[3] != 0
         return hasActiveMounts
 
+    @traced("ipsec_reload")
     def _reload_certs(self, args):
         if self.is_reload:
             if not self.IpsecCmd(args, "ReloadCerts"):
@@ -188,6 +191,7 @@ class IpsecConfigBase(MountHelperBase):
             self.is_reload = False
         return True
 
+    @traced("ipsec_reload")
     def _reload_config(self, args):
         if self.is_reload:
             if not self.IpsecCmd(args, "ReloadConfig"):
@@ -197,7 +201,7 @@ class IpsecConfigBase(MountHelperBase):
 
     def IpsecCmd(self, args, descr=""):
         cmd = self.EXE_PATH + " " + args
-        if not self.RunCmd(cmd, descr):
+        if not self.RunCmd(cmd, descr, timeout=self.CMD_TIMEOUT):
             return SysApp.set_code(SysApp.ERR_IPSEC_CFG)
         return True
 
@@ -251,7 +255,11 @@ class IpsecConfigBase(MountHelperBase):
         return ret
 
     def set_version(self):
-        self.VERSION = get_app_version(self.EXE_PATH, self.VERSION_TAG)
+        self.VERSION = PlatformCaps().get(
+            self.NAME + "_version",
+            lambda: get_app_version(self.EXE_PATH, self.VERSION_TAG),
+            [self.EXE_PATH],
+        )
         if self.VERSION:
             self.LogInfo("IpSec using %s(%s)" % (self.NAME, self.VERSION))
         return self.VERSION
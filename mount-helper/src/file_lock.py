@@ -20,6 +20,10 @@ class LockHandler(MountHelperBase):
     def renew_cert_lock():
         return LockHandler("/var/lock/ibm_mount_helper_renew.lck")
 
+    @staticmethod
+    def metrics_lock():
+        return LockHandler("/var/lock/ibm_mount_helper_prom.lck")
+
     def __init__(self, lock_file):
         self.lock_file = lock_file
         self.lock_fd = -1
@@ -7,12 +7,8 @@
 
 from common import *
 from certificate_handler import CertificateHandler
-import json
+from metrics import Metrics
 import socket
-import ssl
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError, URLError
-from urllib.parse import urlencode
 from datetime import datetime
 
 USE_METADATA_SERVICE = True
@@ -25,11 +21,24 @@ META_URL_INSTANCE = "metadata/v1/instance"
 META_VERSION = "2025-08-26"
 META_FLAVOUR = "ibm"
 META_TIMEOUT = 20
-META_CERTIFICATE_DURATION_MIN = 300
-META_CERTIFICATE_DURATION_MAX = 3600
+META_PROBE_TIMEOUT = 1
+HTTP_UNAUTHORIZED = 401
+META_MAX_RESPONSE_BYTES = 1024 * 1024
+DETECT_VIRT_PATH = "/usr/bin/systemd-detect-virt"
 
 
 class JsonRequest(MountHelperBase):
+    """JSON call to the metadata service over a kept alive connection.
+
+    Finished connections go back to an idle pool per scheme and host, so the
+    token and cert calls of one run share one TCP connect and TLS handshake.
+    A connection is only used by one request at a time.
+    """
+
+    idle = {}
+    lock = threading.Lock()
+    ssl_context = None
+
     def __init__(self):
         self.init_request(None)
 
@@ -41,6 +50,7 @@ class JsonRequest(MountHelperBase):
         self.data = None
         self.response = {}
         self.timeout = timeout
+        self.status = None
 
     def set_data(self, data):
         self.data = data
@@ -56,20 +66,81 @@ class JsonRequest(MountHelperBase):
         self.LogUser("MetadataService: " + usr_msg)
         self.LogDebug("MetadataServiceException: " + err_msg)
 
+    # The link local service is not verified, so the CA store is not loaded.
     def create_ssl_context(self):
-        ctx = ssl.create_default_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        self.context = ctx
-
-    # wrap urlopen to make it easier to test
-
-    def do_urlopen(self, req):
-        return urlopen(req, timeout=self.timeout, context=self.context)
+        if JsonRequest.ssl_context is None:
+            import ssl
+
+            ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+            JsonRequest.ssl_context = ctx
+        self.context = JsonRequest.ssl_context
+
+    def connect(self, scheme, host):
+        with JsonRequest.lock:
+            conn = JsonRequest.idle.pop((scheme, host), None)
+        if conn:
+            return conn, True
+        import http.client
+
+        timeout = self.timeout or None
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, timeout=timeout, context=self.context)
+        else:
+            conn = http.client.HTTPConnection(host, timeout=timeout)
+        return conn, False
+
+    def release(self, scheme, host, conn):
+        with JsonRequest.lock:
+            if (scheme, host) not in JsonRequest.idle:
+                JsonRequest.idle[(scheme, host)] = conn
+                return
+        conn.close()
+
+    @staticmethod
+    def close_all():
+        with JsonRequest.lock:
+            conns = list(JsonRequest.idle.values())
+            JsonRequest.idle = {}
+        for conn in conns:
+            conn.close()
+
+    # wrap the round trip to make it easier to test, returns status, reason and body
+    def do_urlopen(self, method, url, data):
+        import http.client
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(url)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        while True:
+            conn, reused = self.connect(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, body=data, headers=self.headers)
+                resp = conn.getresponse()
+                body = resp.read(META_MAX_RESPONSE_BYTES + 1)
+            except (http.client.RemoteDisconnected, ConnectionError) as ex:
+                conn.close()
+                if not reused:
+                    raise
+                self.LogDebug("Kept alive connection closed, reconnect: " + str(ex))
+                continue
+            except Exception:
+                conn.close()
+                raise
+            if len(body) > META_MAX_RESPONSE_BYTES:
+                conn.close()
+                raise ValueError("Response over %d bytes" % META_MAX_RESPONSE_BYTES)
+            if resp.will_close:
+                conn.close()
+            else:
+                self.release(parts.scheme, parts.netloc, conn)
+            return resp.status, resp.reason, body
 
-    def set_resp_json(self, resp):
+    def set_resp_json(self, data):
         try:
-            data = resp.read()
+            import json
+
             self.response = json.loads(decode(data))
             return self.response is not None
         except Exception as ex:
@@ -79,32 +150,34 @@ class JsonRequest(MountHelperBase):
 
     def do_request(self, method):
         assert not is_empty(self.url)
-
+        import http.client
+        from urllib.parse import urlencode
+
+        url = self.url
+        if len(self.params) > 0:
+            url += "?" + urlencode(self.params)
+        data = self.data.encode("utf-8") if self.data else None
+        self.LogDebug("Url: " + url)
+        start = time.monotonic()
         try:
-            url = self.url
-            if len(self.params) > 0:
-                url += "?" + urlencode(self.params)               
-                    
-            data = self.data.encode("utf-8") if self.data else None           
-            self.LogDebug("Url: " + url)
-            req = Request(url=url, data=data, headers=self.headers, method=method)
-            resp = self.do_urlopen(req)
-            return self.set_resp_json(resp)
+            self.status, reason, body = self.do_urlopen(method, url, data)
+            if self.status < 300:
+                return self.set_resp_json(body)
+            msg = "Problem accessing (%s) - Status:%d Reason:%s" % (url, self.status, reason)
+            self.log_user_error("Http Error", msg)
         except socket.timeout:
             self.log_user_error("Request Timeout Error", "Socket Timeout")
-        except HTTPError as errh:
-            msg = "Problem accessing (%s) - Status:%d Reason:%s Headers(%s)" % (
-                url,
-                errh.code,
-                errh.reason,
-                errh.headers,
-            )
-            self.log_user_error("Http Error", msg)
-        except URLError as erru:
-            msg = "Problem accessing (%s) - Reason:%s" % (url, erru.reason)
+        except (OSError, http.client.HTTPException) as ex:
+            msg = "Problem accessing (%s) - Reason:%s" % (url, str(ex))
             self.log_user_error("Url Error", msg)
-        except:
-            self.log_user_error("UnknownException", "n/a")
+        except Exception as ex:
+            self.log_user_error("UnknownException", str(ex))
+        finally:
+            secs = time.monotonic() - start
+            self.LogDebug("Url: %s %s took %.3fs" % (method, self.url, secs))
+            endpoint = self.url.rstrip("/").rsplit("/", 1)[-1]
+            labels = {"endpoint": endpoint}
+            Metrics.observe("ibmshare_metadata_request_duration_seconds", secs, labels)
         return False
 
     def get_out(self, name):
@@ -136,11 +209,62 @@ class JsonRequest(MountHelperBase):
         return self.do_request("GET")
 
 
+class TokenCache(JsonStateCache):
+    """Instance identity token kept until shortly before it expires.
+
+    The state file is shared by the mount and renewal runs, so a burst of
+    them asks the metadata service for one token. Hits and misses are kept
+    with it for the debug log.
+    """
+
+    CACHE_FILE = LocalInstall.make_filename("metadata-token.json")
+    MARGIN_SECS = 60
+    cache = None
+
+    def count(self, hit):
+        cache = self.load_cache()
+        name = "hits" if hit else "misses"
+        cache[name] = cache.get(name, 0) + 1
+        hits = cache.get("hits", 0)
+        total = hits + cache.get("misses", 0)
+        self.LogDebug(
+            "Token cache %s, hit rate %d%% (%d of %d)"
+            % ("hit" if hit else "miss", 100 * hits // total, hits, total)
+        )
+
+    def get(self):
+        cache = self.load_cache()
+        token = cache.get("token")
+        if token and cache.get("expires_at", 0) > time.time():
+            self.count(True)
+            self.save_cache()
+            return token
+        self.count(False)
+        return None
+
+    def put(self, token, expires_in):
+        cache = self.load_cache()
+        if isinstance(expires_in, int) and expires_in > TokenCache.MARGIN_SECS:
+            cache["token"] = token
+            cache["expires_at"] = time.time() + expires_in - TokenCache.MARGIN_SECS
+        self.save_cache()
+
+    def invalidate(self):
+        cache = self.load_cache()
+        if cache.pop("token", None):
+            self.LogDebug("Token cache invalidated")
+        cache.pop("expires_at", None)
+        self.save_cache()
+
+
 class Metadata(CertificateHandler):
+    ENDPOINT_FILE = LocalInstall.make_filename("metadata-endpoint.json")
+
     def __init__(self):
         super().__init__()
 
         self.token = None
+        self.token_cached = False
         self.instance_id = None
         self.private_key = None
         self.csr = None
@@ -149,32 +273,73 @@ class Metadata(CertificateHandler):
         self.created_at = None
         self.expires_at = None
         self.port = None
+        self.retryable = True  # last failure may pass on a retry
         self.server="virtual"
         self.server=self.detect_virtualization()
 
+    # Use the port that answered last time, or probe both at once.
     def is_metadata_service_available(self):
-        if self.is_port_available(META_IP, META_PORT_HTTP):
+        ports = [META_PORT_HTTP, META_PORT_HTTPS]
+        endpoint = read_json_file(Metadata.ENDPOINT_FILE)
+        if isinstance(endpoint, dict) and endpoint.get("port") in ports:
+            self.port = endpoint["port"]
+            self.LogDebug("Metadata service port %d from the last run" % self.port)
             return True
-        return self.is_port_available(META_IP, META_PORT_HTTPS)
+        self.port = self.probe_ports(META_IP, ports)
+        if self.port is None:
+            return False
+        if LocalInstall.exists():
+            write_json_file(Metadata.ENDPOINT_FILE, {"port": self.port, "scheme": self.scheme()})
+        return True
+
+    # Remember if a retry can help. Without an answer from the service the
+    # ports are probed again on the next run.
+    def request_failed(self, req):
+        self.retryable = RetryPolicy.is_retryable(req.status)
+        if req.status is None and os.path.exists(Metadata.ENDPOINT_FILE):
+            self.LogDebug("Metadata service port %s forgotten" % self.port)
+            os.remove(Metadata.ENDPOINT_FILE)
+
+    # Connect to all ports in parallel, the first port that accepts wins.
+    def probe_ports(self, ip, ports):
+        import queue
+
+        results = queue.Queue()
+        for port in ports:
+            thread = threading.Thread(
+                target=lambda port: results.put((port, self.is_port_available(ip, port))),
+                args=(port,),
+                daemon=True,
+            )
+            thread.start()
+        for _ in ports:
+            port, ok = results.get()
+            if ok:
+                return port
+        return None
 
     def is_port_available(self, ip, port):
         ret = False
         try:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(1)  # Timeout in case of port not open
+                s.settimeout(META_PROBE_TIMEOUT)  # Timeout in case of port not open
                 s.connect((ip, port))
                 s.close()
-                self.port = port
                 ret = True
         except:
             pass
         self.LogDebug("Connect %s:%s %s" % (ip, port, "success" if ret else "failed"))
         return ret
 
+    def scheme(self):
+        return "https" if self.port == META_PORT_HTTPS else "http"
+
     def new_request(self, url, token=None):
-        use_ssl = self.port == META_PORT_HTTPS
-        pfx = "https" if use_ssl else "http"
-        url = "%s://%s/%s" % (pfx, META_IP, url)
+        use_ssl = self.scheme() == "https"
+        host = META_IP
+        if self.port and self.port != (443 if use_ssl else 80):
+            host = "%s:%d" % (META_IP, self.port)  # eg a local stand in
+        url = "%s://%s/%s" % (self.scheme(), host, url)
         req = JsonRequest()
         req.init_request(url, META_TIMEOUT)
         if use_ssl:
@@ -185,36 +350,47 @@ class Metadata(CertificateHandler):
             req.add_header("Authorization", "Bearer " + token)
         return req
 
+    @traced("metadata_token")
     def get_token(self):
         if self.server == "baremetal":
             self.LogInfo("It's a Baremetal Server")
         else:
             self.LogInfo("It's a Virtual Server")
+        cache = TokenCache()
+        self.token = cache.get()
+        self.token_cached = self.token is not None
+        if self.token_cached:
+            return True
         req = self.new_request(META_URL_TOKEN)
         req.add_header("Metadata-Flavor", META_FLAVOUR)
         if not req.put():
+            self.request_failed(req)
             return False
         self.token = req.get_out("access_token")
-        return not is_empty(self.token)
+        if is_empty(self.token):
+            return False
+        cache.put(self.token, req.response.get("expires_in"))
+        return True
 
+    @traced("metadata_cert")
     def generate_certs(self):
         if not self.token or not self.csr:
             self.LogError("Token and csr must be set")
             return False
 
-        cfgShare = ShareConfig(None)
-        expires_in = cfgShare.get_certificate_duration()
-        if (
-            not expires_in
-            or int(expires_in) < META_CERTIFICATE_DURATION_MIN
-            or int(expires_in) > META_CERTIFICATE_DURATION_MAX
-        ):
-            expires_in = str(META_CERTIFICATE_DURATION_MAX)
-        
+        # range checked by ShareSettings
+        expires_in = ShareConfig(None).get_certificate_duration()
         req = self.new_request(META_URL_CERT, self.token)
-        req.set_data('{"csr": "' + self.csr + '", "expires_in": ' + expires_in + '}')
+        req.set_data('{"csr": "' + self.csr + '", "expires_in": ' + str(expires_in) + '}')
         if not req.post():
-            return False
+            self.request_failed(req)
+            if req.status != HTTP_UNAUTHORIZED:
+                return False
+            TokenCache().invalidate()
+            # a cached token may have been revoked, retry once with a new one
+            if not self.token_cached or not self.get_token():
+                return False
+            return self.generate_certs()
 
         def get_cert(cert):
             if cert and self.load_cert(cert):
@@ -239,31 +415,38 @@ class Metadata(CertificateHandler):
             self.LogError("Could not load private key.")
         return False
 
+    @traced("key_gen")
     def new_private_key(self):
         private_key = self.generate_private_key()
         return self.set_private_key(private_key)
 
+    @traced("csr")
     def new_certificate_signing_request(self):
         self.csr = self.generate_csr(self.private_key)
         return not is_empty(self.csr)
     
     def detect_virtualization(self):
+        server = PlatformCaps().get(
+            "server_type", self.probe_virtualization, [DETECT_VIRT_PATH]
+        )
+        return server or "virtual"
+
+    # Returns None when the type is unknown so that it is not cached.
+    def probe_virtualization(self):
         try:
-            kwargs = {}
-            if sys.version_info >= (3, 7):
-                kwargs.update(capture_output=True, text=True)
-            else:
-                kwargs.update(stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-            result = subprocess.run(['systemd-detect-virt'], **kwargs)
-            type = result.stdout.strip()
-            if result.returncode == 0:
-                return "virtual"
-            elif result.returncode == 1:
-            # Exit code 1 means "no virtualization" = baremetal
-                return "baremetal"
-            else:
-                self.LogError(f"Unexpected return code from systemd-detect-virt: {result.returncode}({type})")
-                return "virtual"
+            result = SubProcess(["systemd-detect-virt"]).run()
         except FileNotFoundError:
             self.LogError("Error: 'systemd-detect-virt' not found. Are you on a systemd-based Linux system?")
+            return None
+        if result.timed_out:
+            self.LogError("Error: 'systemd-detect-virt' timed out.")
+            return None
+        type = result.stdout
+        if result.returncode == 0:
             return "virtual"
+        elif result.returncode == 1:
+        # Exit code 1 means "no virtualization" = baremetal
+            return "baremetal"
+        else:
+            self.LogError(f"Unexpected return code from systemd-detect-virt: {result.returncode}({type})")
+            return None
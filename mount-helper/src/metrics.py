@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) IBM Corp. 2025. All Rights Reserved.
+# Project name: VPC File Storage Mount Helper
+# This project is licensed under the MIT License, see LICENSE file in the root directory.
+
+from common import *
+from file_lock import LockHandler
+
+METRICS_DEFAULT_DIR = "/var/lib/node_exporter/textfile_collector"
+METRICS_PROM_FILE = "ibm_mount_helper.prom"
+METRICS_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+METRICS_HELP = {
+    "ibmshare_runs_total": ("counter", "Mount helper runs by run type and transport."),
+    "ibmshare_run_duration_seconds": ("histogram", "Mount helper run wall time."),
+    "ibmshare_errors_total": ("counter", "Failed runs by SysApp error code."),
+    "ibmshare_last_run_timestamp_seconds": ("gauge", "End of the last run."),
+    "ibmshare_cert_renewals_total": ("counter", "Certificate renewal runs."),
+    "ibmshare_cert_renewal_duration_seconds": ("histogram", "Certificate renewal wall time."),
+    "ibmshare_cleanups_total": ("counter", "Unused config cleanup passes."),
+    "ibmshare_cleanup_duration_seconds": ("histogram", "Cleanup pass wall time."),
+    "ibmshare_metadata_request_duration_seconds": (
+        "histogram",
+        "Metadata service request time by endpoint.",
+    ),
+    "ibmshare_cert_expiry_seconds": ("gauge", "Seconds until the certificate expires."),
+    "ibmshare_stunnel_processes": ("gauge", "Running stunnel processes."),
+    "ibmshare_ipsec_config_files": ("gauge", "IPsec connection config files."),
+}
+
+
+def metric_key(name, labels=None):
+    if not labels:
+        return name
+    items = ['%s="%s"' % (k, labels[k]) for k in sorted(labels)]
+    return "%s{%s}" % (name, ",".join(items))
+
+
+def split_metric_key(key):
+    pos = key.find("{")
+    if pos < 0:
+        return key, ""
+    return key[:pos], key[pos + 1 : -1]
+
+
+class Metrics(MountHelperBase):
+    """Prometheus textfile collector output.
+
+    Runs only queue their samples, flush() merges them into the persisted
+    state under a lock and rewrites the .prom file in one rename so
+    node_exporter never reads a partial file.
+    """
+
+    STATE_FILE = LocalInstall.make_filename("metrics-state.json")
+    pending = []
+    certs = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def add(kind, key, value):
+        with Metrics.lock:
+            Metrics.pending.append((kind, key, value))
+
+    @staticmethod
+    def inc(name, labels=None, value=1):
+        Metrics.add("counter", metric_key(name, labels), value)
+
+    @staticmethod
+    def observe(name, secs, labels=None):
+        Metrics.add("histogram", metric_key(name, labels), secs)
+
+    @staticmethod
+    def set_gauge(name, value, labels=None):
+        Metrics.add("gauge", metric_key(name, labels), value)
+
+    # Remember when a loaded cert expires, exported as seconds from now.
+    @staticmethod
+    def cert_expiry(name, crt):
+        if crt and crt.not_after:
+            Metrics.certs[name] = crt.not_after.timestamp()
+
+    # Returns done(ok) which records <name>_duration_seconds and <name>s_total.
+    @staticmethod
+    def timed(name, labels=None):
+        start = time.monotonic()
+        labels = dict(labels) if labels else {}
+
+        def done(ok=True):
+            Metrics.observe(name + "_duration_seconds", time.monotonic() - start, labels)
+            labels["result"] = "ok" if ok else "error"
+            Metrics.inc(name + "s_total", labels)
+
+        return done
+
+    def get_dir(self):
+        path = ShareConfig(None, show_error=False).get_metrics_dir()
+        if not is_empty(path):
+            return path
+        return METRICS_DEFAULT_DIR if os.path.isdir(METRICS_DEFAULT_DIR) else None
+
+    @staticmethod
+    def count_stunnel_processes():
+        cnt = 0
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open("/proc/%s/comm" % pid) as fd:
+                    if fd.read().startswith("stunnel"):
+                        cnt += 1
+            except OSError:
+                pass  # process exited
+        return cnt
+
+    @staticmethod
+    def count_ipsec_configs():
+        ipsec = LocalInstall.get_ipsec_mgr()
+        if not ipsec:
+            return None
+        cfg_path, cfg_prefix, _ = ipsec.get_config_file_parts()
+        if not os.path.isdir(cfg_path):
+            return 0
+        return len([f for f in os.listdir(cfg_path) if f.startswith(cfg_prefix)])
+
+    def merge(self, state, samples):
+        counters = state.setdefault("counters", {})
+        histograms = state.setdefault("histograms", {})
+        gauges = state.setdefault("gauges", {})
+        for kind, key, value in samples:
+            if kind == "counter":
+                counters[key] = counters.get(key, 0) + value
+            elif kind == "gauge":
+                gauges[key] = value
+            else:
+                hist = histograms.setdefault(
+                    key, {"buckets": [0] * len(METRICS_BUCKETS), "sum": 0.0, "count": 0}
+                )
+                for ndx, bound in enumerate(METRICS_BUCKETS):
+                    if value <= bound:
+                        hist["buckets"][ndx] += 1
+                hist["sum"] += value
+                hist["count"] += 1
+        certs = state.setdefault("certs", {})
+        certs.update(Metrics.certs)
+        return state
+
+    def live_gauges(self, state):
+        gauges = dict(state.get("gauges", {}))
+        now = time.time()
+        for name, not_after in state.get("certs", {}).items():
+            key = metric_key("ibmshare_cert_expiry_seconds", {"cert": name})
+            gauges[key] = int(not_after - now)
+        gauges["ibmshare_stunnel_processes"] = self.count_stunnel_processes()
+        configs = self.count_ipsec_configs()
+        if configs is not None:
+            gauges["ibmshare_ipsec_config_files"] = configs
+        return gauges
+
+    def render(self, state):
+        families = {}
+
+        def add_line(name, line):
+            families.setdefault(name, []).append(line)
+
+        for key, value in state.get("counters", {}).items():
+            add_line(split_metric_key(key)[0], "%s %s" % (key, value))
+        for key, value in self.live_gauges(state).items():
+            add_line(split_metric_key(key)[0], "%s %s" % (key, value))
+        for key, hist in state.get("histograms", {}).items():
+            name, labels = split_metric_key(key)
+            sep = "," if labels else ""
+            for ndx, bound in enumerate(METRICS_BUCKETS):
+                add_line(
+                    name,
+                    '%s_bucket{%s%sle="%s"} %d' % (name, labels, sep, bound, hist["buckets"][ndx]),
+                )
+            add_line(name, '%s_bucket{%s%sle="+Inf"} %d' % (name, labels, sep, hist["count"]))
+            suffix = "{%s}" % labels if labels else ""
+            add_line(name, "%s_sum%s %.6f" % (name, suffix, hist["sum"]))
+            add_line(name, "%s_count%s %d" % (name, suffix, hist["count"]))
+
+        lines = []
+        for name in sorted(families):
+            kind, descr = METRICS_HELP.get(name, ("untyped", name))
+            lines.append("# HELP %s %s" % (name, descr))
+            lines.append("# TYPE %s %s" % (name, kind))
+            lines.extend(sorted(families[name]))
+        return "\n".join(lines) + "\n"
+
+    def write_prom(self, path, data):
+        fpath = os.path.join(path, METRICS_PROM_FILE)
+        tmp_path = "%s.%d.tmp" % (fpath, os.getpid())
+        try:
+            with open(tmp_path, "w") as fd:
+                fd.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, fpath)
+            return True
+        except Exception as ex:
+            self.LogException("WriteMetrics", ex, fpath)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return False
+
+    def flush(self):
+        with Metrics.lock:
+            samples = Metrics.pending
+            Metrics.pending = []
+        path = self.get_dir()
+        if not path or not os.path.isdir(path):
+            return False  # no textfile collector configured
+
+        lockhandler = LockHandler.metrics_lock()
+        if not lockhandler.grab_blocking_lock():
+            return False
+        try:
+            state = read_json_file(Metrics.STATE_FILE)
+            state = self.merge(state if isinstance(state, dict) else {}, samples)
+            data = self.render(state)
+            if LocalInstall.exists():
+                write_json_file(Metrics.STATE_FILE, state)
+            return self.write_prom(path, data)
+        finally:
+            lockhandler.release_lock()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) IBM Corp. 2025. All Rights Reserved.
+# Project name: VPC File Storage Mount Helper
+# This project is licensed under the MIT License, see LICENSE file in the root directory.
+
+from common import *
+import socket
+
+AGENT_SOCKET = "/run/mount-ibmshare/agent.sock"
+AGENT_TIMEOUT = 900
+AGENT_MAX_REQUEST = 1024 * 64
+AGENT_SERVICE = "mount-ibmshare-agent.service"
+
+
+class MountAgent(MountHelperBase):
+    """Resident process serving mount, umount and status over a Unix socket.
+
+    Requests are handled one at a time, so the process wide state the mount
+    code relies on (sys.argv, error codes, caches) is never shared.
+    """
+
+    def __init__(self, app_class, path=AGENT_SOCKET):
+        self.app_class = app_class
+        self.path = path
+        self.started = time.monotonic()
+        self.requests = 0
+        self.server = None
+
+    @staticmethod
+    def is_peer_root(conn):
+        import struct
+
+        creds = conn.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        _, uid, _ = struct.unpack("3i", creds)
+        return uid == 0
+
+    @staticmethod
+    def send(wfile, code, output, data=None):
+        import json
+
+        reply = {"code": code, "output": output}
+        if data is not None:
+            reply["data"] = data
+        wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+    def handle(self, conn, rfile, wfile):
+        import json
+
+        try:
+            if not self.is_peer_root(conn):
+                self.send(wfile, 1, "Only root can use the mount agent.")
+                return
+            line = rfile.readline(AGENT_MAX_REQUEST)
+            self.send(wfile, *self.dispatch(json.loads(decode(line))))
+        except Exception as ex:
+            self.LogException("AgentRequest", ex)
+
+    def dispatch(self, req):
+        self.requests += 1
+        OperationDeadline.start()
+        action = req.get("action")
+        if action == "mount":
+            return self.do_mount(req.get("argv", []), req.get("cwd"))
+        if action == "umount":
+            return self.do_umount(req.get("mountpoint", ""))
+        if action == "status":
+            return self.do_status()
+        return 1, "Unknown agent action: " + str(action), None
+
+    # Run the mount code in process with the client's arguments, relative
+    # paths in them are resolved in the client's working directory.
+    def do_mount(self, argv, cwd=None):
+        import io
+        from contextlib import redirect_stdout
+
+        if cwd and not os.path.isdir(cwd):
+            return 1, "Client working directory not found: " + cwd, None
+        saved_argv = sys.argv
+        saved_cwd = os.getcwd()
+        sys.argv = argv
+        SysApp.set_code(None)
+        MountHelperLogger.debug_enabled = False
+        MountTable.invalidate()
+        out = io.StringIO()
+        ret = False
+        try:
+            if cwd:
+                os.chdir(cwd)
+            with redirect_stdout(out):
+                ret = self.app_class().run()
+            code = 0 if ret else SysApp.last_error_code or SysApp.ERR_APP_GENERIC
+        except SystemExit as ex:
+            code = ex.code if isinstance(ex.code, int) else SysApp.ERR_APP_GENERIC
+        finally:
+            sys.argv = saved_argv
+            os.chdir(saved_cwd)
+        return code, out.getvalue(), None
+
+    def do_umount(self, mount_point):
+        if is_empty(mount_point):
+            return 1, "Provide the mount point to unmount.", None
+        out = self.RunCmd(["umount", mount_point], "Umount", ret_out=True)
+        MountTable.invalidate()
+        if not out:
+            return SysApp.ERR_APP_GENERIC, "Umount failed.", None
+        return out.returncode, out.stdout + out.stderr, None
+
+    def do_status(self):
+        MountTable.invalidate()
+        mounts = []
+        for mount in MountTable.snapshot():
+            mounts.append(
+                {
+                    "ip": mount.ip,
+                    "path": mount.mount_path,
+                    "mounted_at": mount.mounted_at,
+                    "port": mount.mount_port,
+                }
+            )
+        data = {
+            "pid": os.getpid(),
+            "uptime_secs": int(time.monotonic() - self.started),
+            "requests": self.requests,
+            "mounts": mounts,
+        }
+        return 0, "", data
+
+    def serve(self):
+        import socketserver
+
+        agent = self
+
+        class MountAgentHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                agent.handle(self.request, self.rfile, self.wfile)
+
+        make_dirs(self.path, is_file=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = socketserver.UnixStreamServer(self.path, MountAgentHandler)
+        os.chmod(self.path, 0o600)
+        self.LogInfo("Mount agent listening on: " + self.path)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.RemoveFile(self.path)
+        return True
+
+
+class MountAgentClient(MountHelperBase):
+    def __init__(self, path=AGENT_SOCKET, timeout=AGENT_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+
+    def is_available(self):
+        return os.path.exists(self.path)
+
+    # Returns the agent reply, or None if the agent could not be reached.
+    # Once connected the agent may already be mounting, so a lost reply is
+    # an error and never a reason to mount again in this process.
+    def request(self, req):
+        import json
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError as ex:
+                self.LogDebug("Mount agent not reachable: " + str(ex))
+                return None
+            try:
+                sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
+                with sock.makefile("rb") as rfile:
+                    return json.loads(decode(rfile.readline()))
+            except Exception as ex:
+                self.LogError(
+                    "No reply from mount agent: " + str(ex),
+                    code=SysApp.ERR_APP_GENERIC,
+                )
+        return {"code": SysApp.ERR_APP_GENERIC, "output": ""}
+
+    # Forward a mount to the agent, None means run it in this process.
+    def forward(self, argv):
+        if not self.is_available():
+            return None
+        try:
+            cwd = os.getcwd()
+        except OSError:
+            return None
+        reply = self.request({"action": "mount", "argv": argv, "cwd": cwd})
+        if reply is None:
+            return None
+        output = reply.get("output", "")
+        if output:
+            sys.stdout.write(output)
+        return reply.get("code", SysApp.ERR_APP_GENERIC)
+
+
+class AgentService(SystemCtl):
+    SERVICE_FILE = "/etc/systemd/system/" + AGENT_SERVICE
+
+    SERVICE_CONFIG = """[Unit]
+Description=IBM mount share helper agent
+After=network-online.target
+[Service]
+ExecStart=%s
+Restart=on-failure
+[Install]
+WantedBy=multi-user.target
+"""
+
+    def __init__(self):
+        super().__init__(AGENT_SERVICE)
+
+    def install(self, command_path):
+        data = AgentService.SERVICE_CONFIG % command_path
+        if not self.WriteFile(AgentService.SERVICE_FILE, data, chmod=0o644):
+            return False
+        self.RunCmd([self.EXE_PATH, "daemon-reload"], "ReloadUnits")
+        return self.enable() is not None
+
+    def teardown(self):
+        if self.FileExists(AgentService.SERVICE_FILE):
+            self.disable()
+            self.RemoveFile(AgentService.SERVICE_FILE)
+        return True
@@ -16,10 +16,15 @@ from renew_certs import RenewCerts
 from config import LocalInstall, StrongSwanConfig
 import stunnel_config_create, find_free_stunnel_port
 from stunnel_config_get import StunnelConfigGet
+from reconcile_shares import ReconcileShares
+from mount_agent import MountAgent, MountAgentClient, AgentService
+from metrics import Metrics
 
-LOOPBACK_ADDRESS = "127.0.0.1"
 MOUNT_PORT = 20049
 STUNNEL_COMMAND = "stunnel"
+STUNNEL_START_TIMEOUT = 60
+# mount.nfs retries a foreground mount for 2 minutes by default
+MOUNT_CMD_TIMEOUT = 180
 
 
 class MountIbmshare(MountHelperBase):
@@ -29,15 +34,24 @@ class MountIbmshare(MountHelperBase):
     def __init__(self):
         self.mounts = []
         self.lockhandler = file_lock.LockHandler.mount_share_lock()
+        self.transport = "none"
 
+    @traced("stunnel_probe")
     def set_installed_stunnel(self):
-        stunnel_dirs = ["/etc/stunnel", "/var/run/stunnel4/", "/var/log/stunnel/"]
-        errored = False
-        for directory in stunnel_dirs:
-            if not os.path.isdir(directory):
+        stunnel_dirs = [
+            StunnelConfigGet.STUNNEL_DIR_NAME,
+            StunnelConfigGet.STUNNEL_PID_FILE_DIR,
+            StunnelConfigGet.STUNNEL_LOG_DIR,
+        ]
+
+        def probe():
+            missing = [d for d in stunnel_dirs if not os.path.isdir(d)]
+            for directory in missing:
                 self.LogError(f"The directory '{directory}' does not exist.")
-                errored = True
+            return None if missing else True
 
+        # Only a complete setup is cached, a missing one is checked again.
+        errored = not PlatformCaps().get("stunnel_dirs", probe, stunnel_dirs)
         if errored:
             self.LogError(
                 f"The Stunnel setup required for encryption in transit is missing."
@@ -48,7 +62,10 @@ class MountIbmshare(MountHelperBase):
 
         return not errored
 
+    @traced("ipsec_probe")
     def set_installed_ipsec(self):
+        if self.get_ipsec_mgr():
+            return True  # already probed, eg by a resident agent
         ss_obj = StrongSwanConfig()
         if ss_obj.set_version():
             LocalInstall.set_ipsec_mgr(ss_obj)
@@ -66,23 +83,15 @@ class MountIbmshare(MountHelperBase):
                 ipsec.remove_all_configs(unused=True)
                 if ipsec.setup():
                     cert_path = SysApp.argv(2)
-                    return RenewCerts().install_root_cert(cert_path)
+                    if RenewCerts().install_root_cert(cert_path):
+                        RenewCerts().prepare_csr()  # not needed to mount
+                        return True
+                    return False
         self.LogError("Installation failed.", code=SysApp.ERR_APP_INSTALL)
         return False
 
     def is_ppc(self):
-        try:
-            answer = subprocess.run(
-                ["uname", "-m"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                check=True
-            ).stdout.strip()
-            return answer.startswith("ppc")
-        except subprocess.CalledProcessError as e:
-            self.LogError(f"Cannot fetch architecture due to exception {e}")
-            return False
+        return os.uname().machine.startswith("ppc")
 
     def app_teardown(self):
         self.LogDebug("TearDown starting")
@@ -92,12 +101,14 @@ class MountIbmshare(MountHelperBase):
             ipsec.remove_all_configs()
         LocalInstall.teardown()
         timer_handler.TimerHandler().teardown()
+        AgentService().teardown()
         self.LogDebug("TearDown complete")
         return True
 
     def renew_certs(self):
         return RenewCerts().renew_cert_cmd_line()
 
+    @traced("lock_wait")
     def lock(self):
         return self.lockhandler.grab_blocking_lock()
 
@@ -106,12 +117,9 @@ class MountIbmshare(MountHelperBase):
 
     # Method to check whether nfs share is already mounted.
     def is_share_mounted(self, ip_address, mount_path, port=""):
-        self.mounts = NfsMount().load_nfs_mounts()
-        for mount in self.mounts:
-            if mount.ip == ip_address and mount.mount_path == mount_path:
-                if port == "" or port == mount.mount_port:
-                    return True
-        return False
+        mount_table = MountTable.snapshot()
+        self.mounts = mount_table.mounts
+        return mount_table.is_mounted(ip_address, mount_path, port)
 
     def configure_default_umask(self):
         # Need to call os.umask twice as the call returns previous seting of umask.
@@ -122,6 +130,15 @@ class MountIbmshare(MountHelperBase):
         return current_umask == desired_default_umask
 
     def process_stunnel_mount(self, args):
+        mount_port = self.prepare_stunnel_mount(args)
+        if not mount_port:
+            return False
+        return self.run_stunnel_mount_command(
+            mount_port, args.mount_path, args.ip_address, False, args
+        )
+
+    # Find or start the stunnel for the share, returns the local mount port.
+    def prepare_stunnel_mount(self, args):
         ip_address = args.ip_address
         mount_path = args.mount_path
         config_file_found = False
@@ -130,7 +147,7 @@ class MountIbmshare(MountHelperBase):
             self.LogError(
                 f"Could not set umask to 0{self.DESIRED_DEFAULT_UMASK:o}. Aborting"
             )
-            return False
+            return None
 
         # Identify a port for stunnel.
         port = find_free_stunnel_port.FindFreeSTunnelPort(
@@ -139,7 +156,7 @@ class MountIbmshare(MountHelperBase):
 
         if port == -1:
             self.LogError("No Free ports found for use by Stunnel.")
-            return False
+            return None
 
         self.LogDebug(f"Local port {port} will be used for setting up the next stunnel")
 
@@ -151,13 +168,13 @@ class MountIbmshare(MountHelperBase):
                 self.LogError(
                     f'Attempt to create directory "{pid_file_dir}" resulted in an exception {ex}. Please fix and retry'
                 )
-                return False
+                return None
 
         if not os.access(pid_file_dir, os.W_OK):
             self.LogError(
                 f'The directory "{pid_file_dir}" is not writable. Make it writable and retry'
             )
-            return False
+            return None
 
         st = StunnelConfigGet()
         st.open_with_remote_path(mount_path, ip_address)
@@ -169,11 +186,13 @@ class MountIbmshare(MountHelperBase):
 
         if not config_file_found:
             if not self.start_stunnel(port, ip_address, mount_path):
-                return False
-        return self.run_stunnel_mount_command(mount_port, mount_path, ip_address, False)
+                return None
+        return mount_port
 
     # Cleans up unused conf files. Should not throw exception .
+    @traced("stunnel_cleanup")
     def cleanup_stale_conf(self, dirname=StunnelConfigGet.STUNNEL_DIR_NAME):
+        done = Metrics.timed("ibmshare_cleanup", {"kind": "stunnel"})
         # os.listdir always listed only one file in unit tests!!!
         for entity in os.scandir(dirname):
             filename = entity.name
@@ -205,6 +224,7 @@ class MountIbmshare(MountHelperBase):
                             self.LogInfo(f"{full_file_name} removed")
                         except Exception as e:
                             self.LogError(f"Removefile returned an exception:{e}")
+        done()
 
     def pid_from_file(self, pid_file):
         try:
@@ -242,6 +262,7 @@ class MountIbmshare(MountHelperBase):
             return True
 
     # Create conf file and start stunnel.
+    @traced("stunnel_start")
     def start_stunnel(self, port, ip_address, mount_path):
         self.LogDebug(f"Starting stunnel for mounting {mount_path}")
         st = stunnel_config_create.StunnelConfigCreate(
@@ -258,41 +279,40 @@ class MountIbmshare(MountHelperBase):
         else:
             conf_file = st.get_config_file()
             self.LogDebug(f"Stunnel conf file created {conf_file}")
-            try:
-                current_path = os.environ.get("PATH", " ")
-                # Dirs where stunnel command is found on various OS versions
-                additional_path = "/usr/bin:/usr/sbin"
-                new_path = f"{additional_path}:{current_path}"
-                env_copy = os.environ.copy()
-                env_copy["PATH"] = new_path
-                self.LogDebug(f"Attempting to start stunnel using {conf_file}")
-                result = subprocess.run(
-                    [STUNNEL_COMMAND, conf_file],
-                    check=False,
-                    env=env_copy,
-                    stderr=subprocess.PIPE,
-                )
-                if result.returncode != 0:
-                    self.LogError(
-                        f'''Stunnel start returned error "{result.stderr.decode('utf-8')}"'''
-                    )
-                    return False
-            except subprocess.CalledProcessError as cpe:
-                self.LogError(f"Stunnel start returned exception {cpe}")
-                return False
+            current_path = os.environ.get("PATH", " ")
+            # Dirs where stunnel command is found on various OS versions
+            additional_path = "/usr/bin:/usr/sbin"
+            new_path = f"{additional_path}:{current_path}"
+            env_copy = os.environ.copy()
+            env_copy["PATH"] = new_path
+            self.LogDebug(f"Attempting to start stunnel using {conf_file}")
+            out = self.RunCmd(
+                [STUNNEL_COMMAND, conf_file],
+                "StunnelStart",
+                ret_out=True,
+                timeout=STUNNEL_START_TIMEOUT,
+                env=env_copy,
+            )
+            if not out or out.is_error():
+                return self.LogError("Stunnel start failed.")
         return True
 
+    @traced("mount_cmd")
     def run_stunnel_mount_command(
-        self, port, mount_path, ip_address, cleanup_config=False
+        self, port, mount_path, ip_address, cleanup_config=False, ah=None
     ):
-        ah = ArgsHandler()
-        ah.parse()
+        if not ah:
+            ah = ArgsHandler()
+            ah.parse()
 
         cmd = ah.get_stunnel_mount_cmd_line(
             port, str(LOOPBACK_ADDRESS) + ":" + mount_path
         )
         self.LogDebug(f"Attempting mount of {mount_path} on local host")
-        out = self.RunCmd(cmd, "Mount using stunnel ", ret_out=True)
+        out = self.RunCmd(
+            cmd, "Mount using stunnel ", ret_out=True, timeout=MOUNT_CMD_TIMEOUT
+        )
+        MountTable.invalidate()
         if not out or out.is_error():
             # Removes conf file as well.
             st = StunnelConfigGet()
@@ -318,45 +338,73 @@ class MountIbmshare(MountHelperBase):
 
     def mount(self, args):
         if not self.is_share_mounted(args.ip_address, args.mount_path):
-            if not args.is_secure or args.is_tls:
-                self.LogUser("Non-IPsec mount requested.")
-                ipsec = self.get_ipsec_mgr()
-                if ipsec:
-                    ipsec.remove_config(args.ip_address)
-                    ipsec.reload_config()
-            else:
-                if self.is_ppc():
-                    self.LogError("Ipsec mounts are not suported on PPC")
-                    self.LogError("Use the -o stunnel option. Remove secure=true")
-                    return False
+            if not self.prepare_mount(args):
+                return False
 
-                cert = RenewCerts()
-                if not cert.root_cert_installed():
-                    self.LogError("Root Certificate must be installed.")
-                    return False
+        self.unlock()
+        return self.run_mount_cmd(args)
 
-                if not cert.load_certificate():
-                    if not cert.get_initial_certs():
-                        return False
+    # Set up or remove the IPsec config for the share. With reload=False
+    # the caller reloads once after preparing several shares.
+    def prepare_mount(self, args, reload=True):
+        if not args.is_secure or args.is_tls:
+            self.LogUser("Non-IPsec mount requested.")
+            ipsec = self.get_ipsec_mgr()
+            if ipsec:
+                ipsec.remove_config(args.ip_address)
+                if reload:
+                    ipsec.reload_config()
+            return True
 
-                if cert.is_certificate_eligible_for_renewal():
-                    if not cert.renew_cert_now():
-                        if cert.is_certificate_expired():
-                            return False
-                        self.LogWarn("Cert has not expired, so will continue.")
+        ipsec = self.prepare_ipsec()
+        if not ipsec or not self.add_ipsec_config(ipsec, args):
+            return False
+        ipsec.cleanup_unused_configs(self.mounts)
+        if reload and not ipsec.reload_config():
+            return False
+        return True
 
-                ipsec = cert.get_ipsec_mgr()
-                if not ipsec.is_running():
-                    return False
-                if not ipsec.create_config(args.ip_address):
-                    return False
-                ipsec.cleanup_unused_configs(self.mounts)
-                ipsec.is_reload = True
-                if not ipsec.reload_config():
-                    return False
+    # Config for one IPsec share, prepare_ipsec() has checked the cert already.
+    def add_ipsec_config(self, ipsec, args):
+        if not ipsec.create_config(args.ip_address):
+            return False
+        ipsec.is_reload = True
+        return True
 
-        self.unlock()
-        out = self.RunCmd(args.get_mount_cmd_line(), "MountCmd", ret_out=True)
+    # Make sure the client cert is valid and IPsec is running.
+    @traced("prepare_ipsec")
+    def prepare_ipsec(self):
+        if self.is_ppc():
+            self.LogError("Ipsec mounts are not suported on PPC")
+            self.LogError("Use the -o stunnel option. Remove secure=true")
+            return None
+
+        cert = RenewCerts()
+        if not cert.root_cert_installed():
+            self.LogError("Root Certificate must be installed.")
+            return None
+
+        if not cert.load_certificate():
+            if not cert.get_initial_certs():
+                return None
+
+        if cert.is_certificate_eligible_for_renewal():
+            if not cert.renew_cert_now():
+                if cert.is_certificate_expired():
+                    return None
+                self.LogWarn("Cert has not expired, so will continue.")
+
+        ipsec = cert.get_ipsec_mgr()
+        if not ipsec.is_running():
+            return None
+        return ipsec
+
+    @traced("mount_cmd")
+    def run_mount_cmd(self, args, alert=True):
+        out = self.RunCmd(
+            args.get_mount_cmd_line(), "MountCmd", ret_out=True, timeout=MOUNT_CMD_TIMEOUT
+        )
+        MountTable.invalidate()
         # When the -v option is used, stdout and stderr may contain additional output.
         if not out or out.is_error():
             if (
@@ -372,19 +420,22 @@ class MountIbmshare(MountHelperBase):
             exit_code = SysApp.ERR_MOUNT + out.returncode if out else SysApp.ERR_MOUNT
             return self.LogError("Share mount failed.", code=exit_code)
 
-        self.ca_certs_alert()
+        if alert:
+            self.ca_certs_alert()
         self.LogUser("Share successfully mounted:" + out.stdout)
         return True
 
     # Check int and root CA certs validity.
     def ca_certs_alert(self):
         cert = RenewCerts()
-        if not cert.load_int_ca_certificate():
-            return False
-        cert.check_ca_certs_validity("Int")
-        if not cert.load_root_ca_certificate():
-            return False
-        cert.check_ca_certs_validity("Root")
+        fpaths = [cert.int_ca_filename(), cert.root_ca_filename()]
+        certs = cert.load_certificates(fpaths)
+        for name, fpath, crt in zip(["Int", "Root"], fpaths, certs):
+            if not crt:
+                return False
+            cert.crypto_x509 = crt
+            Metrics.cert_expiry(name.lower() + "_ca", crt)
+            cert.check_ca_certs_validity(name, fpath)
         return True
 
     def run(self):
@@ -393,6 +444,45 @@ class MountIbmshare(MountHelperBase):
                 "Run the mount as super user.", code=SysApp.ERR_NOT_SUPER_USER
             )
 
+        run_type = ArgsHandler.get_app_run_type().value
+        start = time.monotonic()
+        OperationDeadline.start()
+        Tracer.start(run_type)
+        ret = False
+        try:
+            ret = self.run_app()
+            return ret
+        finally:
+            self.finish_trace()
+            self.record_metrics(run_type, ret, time.monotonic() - start)
+
+    def finish_trace(self):
+        trace_file = ShareConfig(None, show_error=False).get_trace_file()
+        return Tracer().finish(trace_file)
+
+    @staticmethod
+    def get_transport(args, stunnel_requested):
+        if stunnel_requested:
+            return "stunnel"
+        if args.is_tls:
+            return "tls"
+        return "ipsec" if args.is_secure else "plain"
+
+    # Queue the run samples and write the textfile collector output.
+    def record_metrics(self, run_type, ret, secs):
+        labels = {"run_type": run_type, "transport": self.transport}
+        Metrics.observe("ibmshare_run_duration_seconds", secs, labels)
+        labels["result"] = "ok" if ret else "error"
+        Metrics.inc("ibmshare_runs_total", labels)
+        if not ret:
+            code = SysApp.last_error_code or SysApp.ERR_APP_GENERIC
+            Metrics.inc("ibmshare_errors_total", {"run_type": run_type, "code": code})
+        Metrics.set_gauge(
+            "ibmshare_last_run_timestamp_seconds", int(time.time()), {"run_type": run_type}
+        )
+        return Metrics().flush()
+
+    def run_app(self):
         ret = False
         try:
             ArgsHandler.set_logging_level()
@@ -415,9 +505,18 @@ class MountIbmshare(MountHelperBase):
             elif rt.is_renew():
                 ret = self.renew_certs()
                 self.ca_certs_alert()
+            elif rt.is_apply():
+                ret = ReconcileShares(self).apply(ArgsHandler.get_manifest_filename())
+            elif rt.is_agent():
+                ret = MountAgent(MountIbmshare).serve()
+            elif rt.is_enable_agent():
+                ret = AgentService().install(ArgsHandler().get_agent_cmd_line())
+            elif rt.is_disable_agent():
+                ret = AgentService().teardown()
             elif rt.is_mount():
                 args = ArgsHandler.get_mount_args()
                 if args:
+                    self.transport = self.get_transport(args, stunnel_requested)
                     self.lock()
                     if stunnel_requested:
                         self.cleanup_stale_conf()
@@ -433,11 +532,18 @@ class MountIbmshare(MountHelperBase):
             self.LogException("AppRun", ex)
             traceback.print_exc()
             self.unlock()
+            ret = False
         return ret
 
 
 # Entry method for mount helper processing.
 def main():
+    rt = ArgsHandler.get_app_run_type()
+    if rt.is_mount() or rt.is_apply():
+        # a running agent has the state warm, fall back to in process
+        code = MountAgentClient().forward(SysApp.argv())
+        if code is not None:
+            sys.exit(code)
     ret = MountIbmshare().run()
     SysApp.exit(ret)
 
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) IBM Corp. 2025. All Rights Reserved.
+# Project name: VPC File Storage Mount Helper
+# This project is licensed under the MIT License, see LICENSE file in the root directory.
+
+from common import *
+from args_handler import ArgsHandler, MOUNT_OPTION_IPSEC, MOUNT_OPTION_STUNNEL
+from args_handler import MOUNT_OPTION_TLS, TLS_OPTION
+
+TRANSPORT_PLAIN = "plain"
+TRANSPORTS = [TRANSPORT_PLAIN, MOUNT_OPTION_IPSEC, MOUNT_OPTION_STUNNEL, MOUNT_OPTION_TLS]
+
+
+def is_ipsec_share(args):
+    return args.is_secure and not args.is_stunnel and not args.is_tls
+
+
+class ShareManifest(MountHelperBase):
+    """Desired list of shares, read from a json or yaml file.
+
+    {"shares": [{"source": "10.0.0.1:/share", "mountpoint": "/mnt/share",
+                 "options": "rw", "transport": "ipsec"}]}
+    """
+
+    def __init__(self, fname):
+        self.name = fname
+        self.shares = []
+
+    def parse(self, data):
+        if self.name.endswith((".yaml", ".yml")):
+            try:
+                yaml = import_optional("yaml")
+            except ImportError:
+                raise Exception("PyYAML is not installed, use a json manifest")
+            return yaml.safe_load(data)
+        import json
+
+        return json.loads(data)
+
+    def load(self):
+        data = self.ReadFile(self.name) if self.name else None
+        if not data:
+            return self.LogError("Could not read share manifest: " + str(self.name))
+        try:
+            data = self.parse(data)
+        except Exception as ex:
+            return self.LogError("Invalid share manifest %s: %s" % (self.name, ex))
+
+        shares = data.get("shares") if isinstance(data, dict) else data
+        if not isinstance(shares, list):
+            return self.LogError("Share manifest has no list of shares: " + self.name)
+
+        for share in shares:
+            args = self.get_share_args(share)
+            if not args:
+                return False
+            self.shares.append(args)
+        return self.check_transports()
+
+    # A plain or tls mount removes the IPsec config of its IP, which would
+    # break the IPsec shares of that IP.
+    def check_transports(self):
+        ipsec_ips = set(args.ip_address for args in self.shares if is_ipsec_share(args))
+        for args in self.shares:
+            if args.is_stunnel or is_ipsec_share(args):
+                continue
+            if args.ip_address in ipsec_ips:
+                return self.LogError(
+                    "Share %s:%s uses the IP of an IPsec share without IPsec"
+                    % (args.ip_address, args.mount_path)
+                )
+        return True
+
+    def get_share_args(self, share):
+        if not isinstance(share, dict):
+            return self.LogError("Invalid share entry: " + str(share))
+        transport = share.get("transport", TRANSPORT_PLAIN).lower()
+        if transport not in TRANSPORTS:
+            return self.LogError("Unknown transport(%s) for: %s" % (transport, share))
+
+        options = [o for o in share.get("options", "").split(",") if o]
+        if transport != TRANSPORT_PLAIN:
+            options.append(transport)
+        args = ArgsHandler()
+        if not args.set_values(
+            share.get("source", ""), share.get("mountpoint", ""), ",".join(options)
+        ):
+            return None
+        return args
+
+
+class ReconcileShares(MountHelperBase):
+    """Mount every share of a manifest that is not mounted yet.
+
+    Stunnel and IPsec setup is done once under the mount lock, the mount
+    commands then run in parallel with a bounded worker pool.
+    """
+
+    MAX_WORKERS = 8
+
+    def __init__(self, mounter):
+        self.mounter = mounter
+
+    # Mounted from the wanted server and export with the wanted transport.
+    def is_mounted_as(self, mount, args):
+        if not mount or mount.mount_path != args.mount_path:
+            return False
+        if args.is_stunnel:
+            return mount.ip == LOOPBACK_ADDRESS
+        if mount.ip != args.ip_address:
+            return False
+        # the options are only known from mountinfo
+        if mount.options is not None:
+            if (TLS_OPTION in mount.options.split(",")) != args.is_tls:
+                return False
+        if is_ipsec_share(args):
+            ipsec = self.mounter.get_ipsec_mgr()
+            return bool(ipsec and ipsec.get_config(args.ip_address))
+        return True
+
+    # Shares whose mount point is not mounted as the manifest wants it.
+    def get_needed(self, shares):
+        table = MountTable.snapshot()
+        self.mounter.mounts = table.mounts
+        needed = []
+        for args in shares:
+            if self.is_mounted_as(table.get_mounted_at(args.mount_point), args):
+                self.LogDebug("Already mounted: " + args.mount_point)
+            else:
+                needed.append(args)
+        return needed
+
+    # Returns a list of (args, stunnel port) ready to mount.
+    def prepare(self, needed):
+        ready = []
+        stunnel = [args for args in needed if args.is_stunnel]
+        if stunnel:
+            if not self.mounter.set_installed_stunnel():
+                return ready
+            self.mounter.cleanup_stale_conf()
+            for args in stunnel:
+                port = self.mounter.prepare_stunnel_mount(args)
+                if port:
+                    ready.append((args, port))
+
+        other = [args for args in needed if not args.is_stunnel]
+        # the cert and IPsec checks are done once for the whole batch
+        ipsec = None
+        if any(is_ipsec_share(args) for args in other):
+            ipsec = self.mounter.prepare_ipsec()
+        for args in other:
+            if not is_ipsec_share(args):
+                ok = self.mounter.prepare_mount(args, reload=False)
+            else:
+                ok = ipsec and self.mounter.add_ipsec_config(ipsec, args)
+            if ok:
+                ready.append((args, None))
+        if ipsec:
+            ipsec.cleanup_unused_configs(self.mounter.mounts)
+
+        ipsec = self.mounter.get_ipsec_mgr()
+        if other and ipsec and not ipsec.reload_config():
+            # the IPsec configs are not active, skip those shares
+            ready = [r for r in ready if not is_ipsec_share(r[0])]
+        return ready
+
+    def mount_one(self, args, port):
+        if port:
+            return self.mounter.run_stunnel_mount_command(
+                port, args.mount_path, args.ip_address, False, args
+            )
+        return self.mounter.run_mount_cmd(args, alert=False)
+
+    def apply(self, fname):
+        manifest = ShareManifest(fname)
+        if not manifest.load():
+            return False
+
+        self.mounter.lock()
+        needed = self.get_needed(manifest.shares)
+        ready = self.prepare(needed) if needed else []
+        self.mounter.unlock()
+
+        results = []
+        if ready:
+            from concurrent.futures import ThreadPoolExecutor
+
+            workers = min(ReconcileShares.MAX_WORKERS, len(ready))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(lambda r: self.mount_one(*r), ready))
+            MountTable.invalidate()
+            if any(is_ipsec_share(r[0]) for r in ready):
+                self.mounter.ca_certs_alert()
+
+        mounted = results.count(True)
+        failed = len(needed) - mounted
+        self.LogInfo(
+            "Apply %s: Total(%d) AlreadyMounted(%d) Mounted(%d) Failed(%d)"
+            % (
+                fname,
+                len(manifest.shares),
+                len(manifest.shares) - len(needed),
+                mounted,
+                failed,
+            )
+        )
+        return failed == 0
@@ -10,14 +10,16 @@ from certificate_handler import CertificateHandler
 import metadata
 from common import *
 import file_lock
+from metrics import Metrics
 import timer_handler
 
 from config import LocalInstall
 
 
 class RenewCerts(metadata.Metadata):
-    RENEW_RETRY_DELAY = 60  # 1 minute
     RENEW_MAX_RETRIES = -1  # forever
+    # Checked CSR for the installed key, so the next renewal makes neither.
+    PREPARED_CSR_FILE = LocalInstall.make_filename("prepared-csr.json")
 
     def __init__(self):
         super().__init__()
@@ -35,7 +37,10 @@ class RenewCerts(metadata.Metadata):
         return self.run_func(self._renew_cert_now)
 
     def renew_cert_cmd_line(self):
-        return self.run_func(self._renew_cert_cmd_line)
+        done = Metrics.timed("ibmshare_cert_renewal")
+        ret = self.run_func(self._renew_cert_cmd_line)
+        done(ret)
+        return ret
 
     # wrapper func to add lock
     def run_func(self, afunc):
@@ -49,19 +54,32 @@ class RenewCerts(metadata.Metadata):
         lockhandler.release_lock()
         return ret
 
+    # Backoff between metadata attempts, from share.conf.
+    def retry_policy(self, attempts, deadline=0):
+        cfgShare = ShareConfig(None)
+        return RetryPolicy(
+            cfgShare.get_metadata_retry_interval(),
+            cfgShare.get_metadata_retry_max_interval(),
+            attempts,
+            deadline,
+        )
+
     def _get_initial_certs(self):
         cnt = 0
         cfgShare = ShareConfig(None)
-        retry_cnt = cfgShare.get_metadata_retry_count()
-        retry_interval = cfgShare.get_metadata_retry_interval()
-        self.RENEW_MAX_RETRIES = int(retry_cnt)
-        self.RENEW_RETRY_DELAY = int(retry_interval)
-        while cnt < self.RENEW_MAX_RETRIES:
+        self.RENEW_MAX_RETRIES = cfgShare.get_metadata_retry_count()
+        policy = self.retry_policy(self.RENEW_MAX_RETRIES, cfgShare.get_metadata_retry_deadline())
+        while True:
             cnt += 1
-            if self.metadata_renew_cert():
+            with OperationDeadline.nested():
+                renewed = self.metadata_renew_cert()
+            if renewed:
                 return self.load_certificate()
+            delay = policy.next_delay(self.retryable)
+            if delay is None:
+                break
             self.wait(
-                self.RENEW_RETRY_DELAY,
+                round(delay, 1),
                 "Generate cert failed, retry("
                 + str(cnt)
                 + " of "
@@ -73,7 +91,8 @@ class RenewCerts(metadata.Metadata):
     def _renew_cert_cmd_line(self):
         cnt = 0
         self.LogInfo("Metadata renew certs.")
-        while cnt < self.RENEW_MAX_RETRIES or self.RENEW_MAX_RETRIES < 0:
+        policy = self.retry_policy(self.RENEW_MAX_RETRIES)
+        while True:
             cnt += 1
             # check if mount in progress
             lockhandler = file_lock.LockHandler.mount_share_lock()
@@ -84,19 +103,26 @@ class RenewCerts(metadata.Metadata):
                         "Will not renew cert - no nfs mounts active or pending"
                     )
                     return True  # this is ok
-            if self.metadata_renew_cert():
+            with OperationDeadline.nested():
+                renewed = self.metadata_renew_cert()
+            if renewed:
                 return True
             if not metadata.USE_METADATA_SERVICE:
                 return False
-            self.wait(
-                self.RENEW_RETRY_DELAY, "Renew cert failed, retry(" + str(cnt) + ")"
-            )
+            delay = policy.next_delay(self.retryable)
+            if delay is None:
+                break
+            self.wait(round(delay, 1), "Renew cert failed, retry(" + str(cnt) + ")")
+            # mounts may have changed while waiting
+            MountTable.invalidate()
         return False
 
     def _renew_cert_now(self):
         return self._get_initial_certs()
 
+    @traced("cert_renew")
     def metadata_get_new_certs(self):
+        self.retryable = True
         if not self.is_metadata_service_available():
             return self.LogError(
                 "Could not connect to Metadata service.",
@@ -108,8 +134,22 @@ class RenewCerts(metadata.Metadata):
                 "Problem getting token", code=SysApp.ERR_METADATA_TOKEN
             )
 
-        ipsec = self.get_ipsec_mgr()
-        private_key = ipsec.read_private_key()
+        private_key = self.get_ipsec_mgr().read_private_key()
+        prepared = self.load_prepared_csr(private_key)
+        if not prepared and not self.new_key_and_csr(private_key):
+            return self.LogError("Problem with generating signing request.")
+
+        if not self.generate_certs():
+            return self.LogError(
+                "Generate certs failed.", code=SysApp.ERR_METADATA_CERT_RENEW
+            )
+        if not prepared:
+            self.save_prepared_csr()  # accepted, reuse it next time
+        return True
+
+    def new_key_and_csr(self, private_key):
+        if private_key and not self.key_type_ok(private_key):
+            private_key = None
         if private_key:
             self.LogDebug("RenewCert:Use existing private key")
             private_key = self.set_private_key(private_key)
@@ -117,15 +157,62 @@ class RenewCerts(metadata.Metadata):
         if not private_key:
             self.new_private_key()
 
-        if not self.new_certificate_signing_request():
-            return self.LogError("Problem with generating signing request.")
+        return self.new_certificate_signing_request()
 
-        if not self.generate_certs():
-            return self.LogError(
-                "Generate certs failed.", code=SysApp.ERR_METADATA_CERT_RENEW
-            )
+    @staticmethod
+    def key_hash(private_key):
+        import hashlib
+
+        return hashlib.sha256(private_key.encode("utf-8")).hexdigest()
+
+    # Use the prepared CSR if it was made for the installed key. Only the CSR
+    # and a hash of the key are kept, the key itself stays in its key file.
+    def load_prepared_csr(self, private_key):
+        data = read_json_file(self.PREPARED_CSR_FILE)
+        if not private_key or not isinstance(data, dict) or not data.get("csr"):
+            return False
+        if data.get("key_sha256") != self.key_hash(private_key):
+            self.LogDebug("RenewCert:Prepared CSR is for another key")
+            return False
+        if not self.key_type_ok(private_key):
+            return False
+        self.LogDebug("RenewCert:Use installed key and prepared CSR")
+        self.private_key = private_key
+        self.csr = data["csr"]
         return True
 
+    def save_prepared_csr(self):
+        if LocalInstall.exists() and self.private_key and self.csr:
+            data = {"key_sha256": self.key_hash(self.private_key), "csr": self.csr}
+            write_json_file(self.PREPARED_CSR_FILE, data)
+
+    # Generate and check the key and CSR ahead of the first mount. A new key
+    # goes to the key file right away, an installed key of another type is
+    # only replaced at the next renewal.
+    @traced("csr_prepare")
+    def prepare_csr(self):
+        if not metadata.USE_METADATA_SERVICE:
+            return True
+        ipsec = self.get_ipsec_mgr()
+        private_key = ipsec.read_private_key()
+        if self.load_prepared_csr(private_key):
+            return True
+        if private_key and not self.key_type_ok(private_key):
+            self.LogDebug("RenewCert:Key type changed, no CSR prepared")
+            return True
+        if not private_key:
+            if not self.new_private_key():
+                return False
+            if not ipsec.write_cert(ipsec.private_key_filename(), self.private_key):
+                return False
+        elif not self.set_private_key(private_key):
+            return False
+        if self.new_certificate_signing_request() and self.validate_csr(self.csr):
+            self.save_prepared_csr()
+            return True
+        self.LogWarn("Could not prepare the certificate signing request.")
+        return False
+
     def metadata_renew_cert(self):
         if not metadata.USE_METADATA_SERVICE:
             self.LogDebug("Checking for local certs in: " + LocalInstall.cert_path())
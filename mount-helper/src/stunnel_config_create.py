@@ -7,6 +7,7 @@
 import os
 import re
 from datetime import datetime
+from common import ShareSettings
 from stunnel_config_get import StunnelConfigGet
 
 
@@ -56,22 +57,16 @@ class StunnelConfigCreate:
 
     # Extract the value from the key value in conf file.
     def get_from_ibmshare_config(self, conf_file_name, key_name):
-        value = None
         self.valid = True
-        try:
-            with open(conf_file_name, "r") as file:
-                for line in file:
-                    if line.lstrip().startswith(key_name):
-                        value = line.split("=", 1)[1]
-        except Exception as e:
+        values = ShareSettings().load(conf_file_name)
+        if values is None:
             self.valid = False
-            self.error = f"Could not read from {conf_file_name} due to exception {e}"
+            self.error = f"Could not read from {conf_file_name}"
+            return None
 
+        value = values.get(key_name.lower())
         if value is None:
             self.valid = False
-        else:
-            value = value.strip()
-
         return value
 
     def write_file(self):
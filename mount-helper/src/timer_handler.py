@@ -18,6 +18,7 @@ Description=Mount helper timer
 [Timer]
 Unit=mount_helper.service
 OnCalendar=%s
+AccuracySec=1s
 [Install]
 WantedBy=timers.target
 """
@@ -5,6 +5,7 @@
 from unittest.mock import MagicMock
 from unittest import mock
 import unittest
+import json
 from io import StringIO
 from test_common import *
 from common import *
@@ -19,6 +20,28 @@ class TestCommonCode(unittest.TestCase):
         self.assertEqual(to_int(" 123 "), 123)
         self.assertEqual(to_int("  "), 0)
 
+    def test_import_optional(self):
+        self.assertEqual(import_optional("json").__name__, "json")
+        with self.assertRaises(ImportError):
+            import_optional("no_such_module_here")
+
+    def test_write_json_file_threads(self):
+        import threading
+
+        fpath = test_folder.get_temp_filename(".json")
+        data = [{"writer": n, "data": "x" * 100000} for n in range(8)]
+        threads = [
+            threading.Thread(target=write_json_file, args=(fpath, item)) for item in data
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIn(read_json_file(fpath), data)
+        self.assertEqual(os.stat(fpath).st_mode & 0o777, 0o600)
+        leftover = [f for f in os.listdir(test_folder.name) if f.endswith(".tmp")]
+        self.assertEqual(leftover, [])
+
     def test_log_to_file(self):
         tst = MountHelperLogger()
         tst.SetLogToFileEnabled()
@@ -63,5 +86,373 @@ class TestCommonCode(unittest.TestCase):
         self.assertIsNone(version)
 
 
+MOUNTINFO = """22 1 0:21 / /proc rw,nosuid - proc proc rw
+36 22 0:44 / /mnt/a rw,relatime shared:1 - nfs4 myhost:/share1 rw,vers=4.1,port=10001,addr=1.1.1.1
+37 22 0:45 / /mnt/with\\040space rw - nfs 2.2.2.2:/share2 rw,vers=3,mountport=635
+38 22 0:46 / /mnt/b rw - nfs4 3.3.3.3:/share3 rw,vers=4.1,addr=3.3.3.3
+"""
+
+
+class TestMountTable(unittest.TestCase):
+
+    def load(self, data):
+        fname = test_folder.get_temp_filename("mountinfo")
+        write_file(fname, data)
+        with mock.patch("common.NfsMount.MOUNTINFO_FILE", fname):
+            with MySubProcess(0, "") as run:
+                table = MountTable.load()
+                self.assertEqual(run.func.call_count, 0)
+        return table
+
+    def test_mountinfo_parse(self):
+        table = self.load(MOUNTINFO)
+        self.assertEqual(len(table), 3)
+        mount = table.mounts[0]
+        self.assertEqual(mount.ip, "1.1.1.1")
+        self.assertEqual(mount.mount_path, "/share1")
+        self.assertEqual(mount.mounted_at, "/mnt/a")
+        self.assertEqual(mount.mount_port, "10001")
+        self.assertTrue("vers=4.1" in mount.options)
+        mount = table.mounts[1]
+        self.assertEqual(mount.ip, "2.2.2.2")
+        self.assertEqual(mount.mounted_at, "/mnt/with space")
+        self.assertIsNone(mount.mount_port)
+
+    def test_mountinfo_lookup(self):
+        table = self.load(MOUNTINFO)
+        self.assertTrue(table.is_mounted("1.1.1.1", "/share1"))
+        self.assertTrue(table.is_mounted("1.1.1.1", "/share1", "10001"))
+        self.assertFalse(table.is_mounted("1.1.1.1", "/share1", "10002"))
+        self.assertFalse(table.is_mounted("1.1.1.1", "/share3"))
+        self.assertTrue(table.has_ip("3.3.3.3"))
+        self.assertFalse(table.has_ip("4.4.4.4"))
+
+    @mock.patch("common.NfsMount.MOUNTINFO_FILE", "/proc/does/not/exist")
+    def test_mount_cmd_fallback(self):
+        data = "5.5.5.5:/share5 on /mnt/c type nfs4 (rw,port=2049)\n\nbadhost:/x on\n"
+        with MySubProcess(0, data) as run, mock.patch.object(
+            NameResolver, "resolve_all", autospec=True, side_effect=NameResolver.resolve_all
+        ) as resolve_all:
+            table = MountTable.load()
+            self.assertEqual(run.func.call_count, 1)
+        # blank and short lines are skipped
+        self.assertEqual(resolve_all.call_args_list[0][0][1], ["5.5.5.5"])
+        self.assertEqual(len(table.mounts), 1)
+        self.assertTrue(table.is_mounted("5.5.5.5", "/share5", "2049"))
+
+
+class TestSubProcessDeadlines(unittest.TestCase):
+
+    def tearDown(self):
+        OperationDeadline.clear()
+
+    def test_timeout_kills_process_group(self):
+        marker = test_folder.get_temp_filename(".done")
+        # the child of the shell must be killed too, or it writes the marker
+        proc = SubProcess(["sh", "-c", "(sleep 2; touch %s) & wait" % marker], 0.5)
+        out = proc.run()
+        self.assertTrue(proc.timed_out)
+        self.assertEqual(out.returncode, SubProcess.TIMEOUT_CODE)
+        self.assertIn("timed out", out.stderr)
+        self.assertLess(proc.elapsed, 2)
+        time.sleep(2.5)
+        self.assertFalse(os.path.exists(marker))
+
+    def test_operation_deadline(self):
+        OperationDeadline.start(0.3)
+        self.assertLessEqual(OperationDeadline.limit(60), 0.3)
+        time.sleep(0.4)
+        spawned = SubProcess.spawned
+        out = SubProcess(["true"]).run()
+        self.assertEqual(out.returncode, SubProcess.TIMEOUT_CODE)
+        self.assertEqual(SubProcess.spawned, spawned)
+
+    def test_nested_deadline(self):
+        outer = OperationDeadline.start(0.3)
+        with OperationDeadline.nested(30) as step:
+            self.assertIs(OperationDeadline.current, step)
+            # each attempt has its own budget
+            self.assertGreater(OperationDeadline.limit(60), 20)
+        self.assertIs(OperationDeadline.current, outer)
+
+    def test_run_cmds_concurrent(self):
+        start = time.monotonic()
+        outs = MountHelperBase().RunCmds(
+            [["sh", "-c", "sleep 0.5; echo one"], ["sh", "-c", "sleep 0.5; echo two"]],
+            "Concurrent",
+        )
+        self.assertLess(time.monotonic() - start, 0.9)
+        self.assertEqual([out.stdout for out in outs], ["one", "two"])
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_backoff_capped_with_jitter(self):
+        delays = []
+        for _ in range(50):
+            policy = RetryPolicy(1, 5, attempts=7)
+            delays.append([policy.next_delay() for _ in range(7)])
+        for run in delays:
+            self.assertIsNone(run[-1])
+            for pos, delay in enumerate(run[:-1]):
+                self.assertTrue(0 <= delay <= min(5, 2 ** pos))
+        self.assertGreater(len(set(run[3] for run in delays)), 1)
+
+    def test_not_retryable(self):
+        self.assertTrue(RetryPolicy.is_retryable(None))
+        self.assertTrue(RetryPolicy.is_retryable(429))
+        self.assertTrue(RetryPolicy.is_retryable(503))
+        self.assertFalse(RetryPolicy.is_retryable(403))
+        self.assertIsNone(RetryPolicy(1, 5, attempts=7).next_delay(retryable=False))
+        # without an attempt limit it waits up to the cap
+        policy = RetryPolicy(1, 5)
+        with mock.patch("random.uniform", side_effect=lambda low, high: high):
+            self.assertEqual(policy.next_delay(retryable=False), 5)
+            self.assertEqual(policy.next_delay(), 2)
+
+    def test_deadline(self):
+        policy = RetryPolicy(10, 10, deadline=0.2)
+        self.assertLessEqual(policy.next_delay(), 0.2)
+        time.sleep(0.25)
+        self.assertIsNone(policy.next_delay())
+
+    def test_operation_deadline_not_applied(self):
+        OperationDeadline.start(0)
+        try:
+            policy = RetryPolicy(1, 1, deadline=60)
+            self.assertIsNotNone(policy.next_delay())
+        finally:
+            OperationDeadline.clear()
+
+
+class TestTracer(unittest.TestCase):
+
+    def tearDown(self):
+        Tracer.root = None
+
+    @traced("outer")
+    def outer(self):
+        SubProcess(["true"]).run()
+        with Tracer.span("inner"):
+            SubProcess(["true"]).run()
+
+    def test_nested_spans(self):
+        Tracer.start("MNT")
+        self.outer()
+        with MySubProcess(0, ""):
+            self.outer()  # run is mocked, nothing forked
+        line = Tracer().finish()
+        self.assertTrue(line.startswith("trace=MNT total="))
+        self.assertIn(" forks=2 ", line)
+        names = [span.name for span in Tracer.spans]
+        self.assertEqual(names, ["MNT", "outer", "outer/inner", "outer", "outer/inner"])
+        self.assertEqual([span.forks for span in Tracer.spans], [2, 2, 1, 0, 0])
+        self.assertIsNone(Tracer.root)
+
+    def test_not_started(self):
+        with Tracer.span("nothing") as span:
+            self.assertIsNotNone(span)
+        self.assertIsNone(Tracer().finish())
+
+    def test_trace_file(self):
+        trace_file = test_folder.get_temp_filename(".trace")
+        for _ in range(2):
+            Tracer.start("APL")
+            self.outer()
+            Tracer().finish(trace_file)
+        with open(trace_file) as fd:
+            lines = fd.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        self.assertEqual(len(spans), 3)
+        self.assertEqual(spans[2]["parentSpanId"], spans[1]["spanId"])
+        self.assertLessEqual(spans[0]["startTimeUnixNano"], spans[1]["startTimeUnixNano"])
+        self.assertEqual(spans[1]["attributes"][0]["value"]["intValue"], 2)
+
+
+class TestShareSettings(unittest.TestCase):
+
+    def setUp(self):
+        self.fname = test_folder.get_temp_filename(".conf")
+
+    def tearDown(self):
+        ShareSettings.forget(self.fname)
+
+    def test_typed_values(self):
+        write_file(
+            self.fname,
+            "# region=xxx\n Region = dal, xtc\nmetadata_retry_count=5\n"
+            "metadata_retry_interval=soon\ncertificate_duration_seconds=10\n"
+            "TRUSTED_ROOT_CACERT=/etc/ssl/a b.pem\nregion=yyy\n",
+        )
+        values = ShareSettings().load(self.fname)
+        self.assertEqual(values["region"], "dal,xtc")
+        self.assertEqual(values["metadata_retry_count"], 5)
+        self.assertEqual(values["metadata_retry_interval"], 60)  # invalid
+        self.assertEqual(values["certificate_duration_seconds"], 3600)  # range
+        self.assertEqual(values["trusted_root_cacert"], "/etc/ssl/a b.pem")
+        self.assertIsNone(values["trace_file"])
+        self.assertIsNone(ShareSettings().load(self.fname + ".missing"))
+
+    def test_parsed_once_per_change(self):
+        write_file(self.fname, "metadata_retry_count=5\n")
+        with mock.patch.object(ShareSettings, "parse", wraps=ShareSettings().parse) as parse:
+            for _ in range(3):
+                self.assertEqual(ShareSettings().load(self.fname)["metadata_retry_count"], 5)
+            self.assertEqual(parse.call_count, 1)
+            write_file(self.fname, "metadata_retry_count=12\n")
+            self.assertEqual(ShareSettings().load(self.fname)["metadata_retry_count"], 12)
+            self.assertEqual(parse.call_count, 2)
+
+    def test_share_config_getters(self):
+        path = os.path.dirname(self.fname)
+        cfg = ShareConfig(path)
+        ShareSettings.forget(cfg.name)
+        if os.path.exists(cfg.name):
+            os.remove(cfg.name)
+        self.assertIsNone(cfg.get_region())
+        self.assertEqual(cfg.get_metadata_retry_count(), 25)
+        self.assertEqual(cfg.get_metadata_retry_max_interval(), 300)
+        self.assertEqual(cfg.get_metadata_retry_deadline(), 1800)
+        self.assertEqual(cfg.get_cert_renewal_window(), 20)
+        self.assertEqual(cfg.get_client_key_type(), "rsa4096")
+        cfg.data = "region=dal\ncertificate_duration_seconds=600\nclient_key_type=ECDSA-P256"
+        self.assertTrue(cfg.write())
+        self.assertEqual(cfg.get_region(), "dal")
+        self.assertEqual(cfg.get_certificate_duration(), 600)
+        self.assertEqual(cfg.get_client_key_type(), "ecdsa-p256")
+        os.remove(cfg.name)
+
+
+class TestNameResolver(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_cache(self, NameResolver)
+
+    @mock.patch("socket.getaddrinfo")
+    def test_ip_address_no_lookup(self, getaddrinfo):
+        self.assertEqual(NameResolver().resolve("10.1.2.3"), "10.1.2.3")
+        self.assertEqual(getaddrinfo.call_count, 0)
+        self.assertEqual(NfsMount.extract_source("10.1.2.3:/p1"), ("10.1.2.3", "/p1"))
+
+    @mock.patch("socket.getaddrinfo")
+    def test_lookup_cached_and_persisted(self, getaddrinfo):
+        getaddrinfo.return_value = [(2, 1, 6, "", ("10.9.9.9", 0))]
+        self.assertEqual(NameResolver().resolve("myhost"), "10.9.9.9")
+        self.assertEqual(NameResolver().resolve("myhost"), "10.9.9.9")
+        self.assertEqual(getaddrinfo.call_count, 1)
+
+        NameResolver.cache = None  # next invocation loads from file
+        self.assertEqual(NameResolver().resolve("myhost"), "10.9.9.9")
+        self.assertEqual(getaddrinfo.call_count, 1)
+
+    @mock.patch("socket.getaddrinfo")
+    def test_lookup_deadline(self, getaddrinfo):
+        getaddrinfo.side_effect = lambda *args: time.sleep(3)
+        with mock.patch.object(NameResolver, "LOOKUP_TIMEOUT_SECS", 0.2):
+            start = time.monotonic()
+            out = NameResolver().resolve_all(["slow1", "slow2", "slow3"])
+            self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(out, {"slow1": None, "slow2": None, "slow3": None})
+        self.assertEqual(NfsMount.extract_source(""), (None, None))
+
+    @mock.patch("socket.getaddrinfo")
+    def test_lookup_deadline_whole_call(self, getaddrinfo):
+        getaddrinfo.side_effect = lambda *args: time.sleep(3)
+        hosts = ["slow%d" % n for n in range(NameResolver.MAX_WORKERS * 3)]
+        with mock.patch.object(NameResolver, "LOOKUP_TIMEOUT_SECS", 0.2):
+            start = time.monotonic()
+            out = NameResolver().resolve_all(hosts)
+            self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(out, dict((host, None) for host in hosts))
+        # only the first batch was looked up, its failures are cached
+        queried = hosts[: NameResolver.MAX_WORKERS]
+        self.assertEqual(getaddrinfo.call_count, len(queried))
+        self.assertEqual(sorted(NameResolver.cache), sorted(queried))
+        start = time.monotonic()
+        self.assertIsNone(NameResolver().resolve("slow1"))
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(getaddrinfo.call_count, len(queried))
+
+
+class TestPlatformCaps(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_cache(self, PlatformCaps)
+        self.exe = test_folder.get_temp_filename("exe")
+        write_file(self.exe, "v1")
+        self.probe = MagicMock(return_value="1.2.3")
+
+    def get(self):
+        return PlatformCaps().get("exe_version", self.probe, [self.exe])
+
+    @mock.patch.object(LocalInstall, "exists", return_value=True)
+    def test_cached_and_persisted(self, exists):
+        self.assertEqual(self.get(), "1.2.3")
+        self.assertEqual(self.get(), "1.2.3")
+        PlatformCaps.cache = None  # next invocation loads from file
+        self.assertEqual(self.get(), "1.2.3")
+        self.assertEqual(self.probe.call_count, 1)
+
+    def test_probed_again_on_change(self):
+        self.get()
+        os.utime(self.exe, ns=(0, 0))
+        self.get()
+        self.assertEqual(self.probe.call_count, 2)
+        with mock.patch.object(PlatformCaps, "boot_id", return_value="other"):
+            self.get()
+        self.assertEqual(self.probe.call_count, 3)
+
+    def test_failed_probe_not_cached(self):
+        self.probe.return_value = None
+        self.assertIsNone(self.get())
+        self.assertIsNone(self.get())
+        self.assertEqual(self.probe.call_count, 2)
+
+
+class TestPackagesInstalled(unittest.TestCase):
+
+    def setUp(self):
+        use_temp_cache(self, PlatformCaps)
+        self.status = test_folder.get_temp_filename("status")
+        self.sysctl = SystemCtl("test")
+        self.sysctl.DPKG_STATUS = self.status
+
+    def test_dpkg_exact_names(self):
+        write_file(self.status, "\n".join([
+            "Package: ktls-utils-doc", "Status: install ok installed", "",
+            "Package: ca-certificates", "Architecture: all",
+            "Status: install ok installed", "",
+            "Package: ktls-utils", "Status: deinstall ok config-files", "",
+        ]))
+        names = ["ktls-utils", "ca-certificates"]
+        expected = {"ktls-utils": False, "ca-certificates": True}
+        self.assertEqual(self.sysctl.packages_installed(names), expected)
+        mtime = os.stat(self.status).st_mtime_ns
+        write_file(self.status, "")
+        os.utime(self.status, ns=(mtime, mtime))  # not read again, mtime unchanged
+        self.assertEqual(self.sysctl.packages_installed(names), expected)
+        os.utime(self.status, ns=(0, 0))
+        self.assertFalse(self.sysctl.tls_package_installed("ca-certificates"))
+        self.assertFalse(self.sysctl.packages_installed(names)["ca-certificates"])
+
+    def test_dpkg_unreadable(self):
+        os.mkdir(self.status)
+        SysApp.set_code(None)
+        ret = self.sysctl.packages_installed(["ktls-utils"])
+        self.assertEqual(ret, {"ktls-utils": False})
+        self.assertFalse(SysApp.is_code(SysApp.ERR_PYTHON_EXCEPTION))
+
+    def test_rpm_query(self):
+        self.sysctl.RPM_PATH = self.status
+        write_file(self.status, "")
+        self.sysctl.DPKG_STATUS = self.status + ".missing"
+        out = "ca-certificates\npackage ktls-utils is not installed\n"
+        with MySubProcess(1, out) as run:
+            ret = self.sysctl.packages_installed(["ktls-utils", "ca-certificates"])
+            self.assertEqual(run.func.call_count, 1)
+        self.assertEqual(ret, {"ktls-utils": False, "ca-certificates": True})
+
+
 if __name__ == '__main__':
     unittest.main()
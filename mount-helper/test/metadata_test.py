@@ -10,11 +10,11 @@ from test_common import *
 from common import *
 import socket
 import ssl
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError, URLError
-from urllib.parse import urlencode
-import io
+import http.client
 import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import time
 
 
 def newJRequest(data=None, ex=None):
@@ -26,7 +26,7 @@ def newJRequest(data=None, ex=None):
         req.do_urlopen = MagicMock(side_effect=ex)
     elif data:
         data = json.dumps(data).encode('utf-8')
-        req.do_urlopen = MagicMock(return_value=io.BytesIO(data))
+        req.do_urlopen = MagicMock(return_value=(200, "OK", data))
 
     return req
 
@@ -91,16 +91,14 @@ class TestJsonRequest(unittest.TestCase):
 
     def test_get_resp_json_ok(self):
         data = {"field1": "val1"}
-        resp = io.BytesIO(json.dumps(data).encode('utf-8'))
         req = newJRequest()
-        ret = req.set_resp_json(resp)
+        ret = req.set_resp_json(json.dumps(data).encode('utf-8'))
         self.assertTrue(ret)
         self.assertEqual(req.response, data)
 
     def test_get_resp_json_invalid_json(self):
-        resp = io.BytesIO("bad json".encode('utf-8'))
         req = newJRequest()
-        ret = req.set_resp_json(resp)
+        ret = req.set_resp_json("bad json".encode('utf-8'))
         self.assertFalse(ret)
 
     def test_get_resp_json_invalid_io_object(self):
@@ -109,11 +107,10 @@ class TestJsonRequest(unittest.TestCase):
         self.assertFalse(ret)
 
     def test_do_request_test_each_error(self):
-        array = [(URLError("test"), "Url Error"),
+        array = [(ConnectionRefusedError("test"), "Url Error"),
+                 (http.client.BadStatusLine("test"), "Url Error"),
                  (socket.timeout(), "Socket Timeout"),
-                 (Exception("test"), "UnknownException"),
-                 (HTTPError('http://ibm.com', 500,
-                  'Internal Error', {}, None), "Http Error")]
+                 (Exception("test"), "UnknownException")]
 
         for ex, descr in array:
             req = newJRequest(ex=ex)
@@ -121,14 +118,142 @@ class TestJsonRequest(unittest.TestCase):
             self.assertFalse(ret)
             self.assertTrue(req.HasLogMessage(descr))
 
+        req = newJRequest()
+        req.do_urlopen = MagicMock(return_value=(500, "Internal Error", b""))
+        self.assertFalse(req.do_request("GET"))
+        self.assertEqual(req.status, 500)
+        self.assertTrue(req.HasLogMessage("Http Error"))
+
     def test_do_request_ok(self):
         req = newJRequest(data={"field1": "val1"})
         ret = req.do_request("GET")
         self.assertTrue(ret)
         self.assertEqual(req.get_out("field1"), "val1")
+        self.assertTrue(req.HasLogMessage("Url: GET http://ibm.com took "))
+
+
+class TestMetadataEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.exists = mock.patch.object(LocalInstall, "exists", return_value=True)
+        self.exists.start()
+
+    def tearDown(self):
+        self.exists.stop()
+        if os.path.exists(metadata.Metadata.ENDPOINT_FILE):
+            os.remove(metadata.Metadata.ENDPOINT_FILE)
+
+    def slow_http_port(self, ip, port):
+        if port == metadata.META_PORT_HTTP:
+            time.sleep(0.5)
+            return False
+        return True
+
+    def test_probe_ports_concurrently(self):
+        meta = newMetadata()
+        meta.is_port_available = MagicMock(side_effect=self.slow_http_port)
+        start = time.monotonic()
+        self.assertTrue(meta.is_metadata_service_available())
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(meta.port, metadata.META_PORT_HTTPS)
+        self.assertTrue(meta.new_request("my/Url").url.startswith("https://169.254.169.254/"))
+
+    def test_no_port_available(self):
+        meta = newMetadata()
+        meta.is_port_available = MagicMock(return_value=False)
+        self.assertFalse(meta.is_metadata_service_available())
+        self.assertEqual(meta.is_port_available.call_count, 2)
+        self.assertFalse(os.path.exists(metadata.Metadata.ENDPOINT_FILE))
+
+    def test_remembered_until_failure(self):
+        meta = newMetadata()
+        meta.is_port_available = MagicMock(side_effect=self.slow_http_port)
+        self.assertTrue(meta.is_metadata_service_available())
+        meta2 = newMetadata()
+        meta2.is_port_available = MagicMock(return_value=False)
+        self.assertTrue(meta2.is_metadata_service_available())
+        self.assertEqual(meta2.port, metadata.META_PORT_HTTPS)
+        self.assertEqual(meta2.is_port_available.call_count, 0)
+
+        # an HTTP error status keeps the port, no answer at all forgets it
+        req = newJRequest()
+        req.status = 500
+        meta2.request_failed(req)
+        self.assertTrue(meta2.retryable)
+        self.assertTrue(os.path.exists(metadata.Metadata.ENDPOINT_FILE))
+        req.status = 403
+        meta2.request_failed(req)
+        self.assertFalse(meta2.retryable)
+        meta2.request_failed(newJRequest())
+        self.assertTrue(meta2.retryable)
+        self.assertFalse(meta2.is_metadata_service_available())
+        self.assertEqual(meta2.is_port_available.call_count, 2)
+
+
+class KeepAliveStub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    body = b'{"access_token": "myToken"}'
+
+    def setup(self):
+        KeepAliveStub.connections += 1
+        super().setup()
+
+    def do_PUT(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestKeepAlive(unittest.TestCase):
+    def setUp(self):
+        KeepAliveStub.connections = 0
+        self.server = HTTPServer(("127.0.0.1", 0), KeepAliveStub)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%d/identity/v1/token" % self.server.server_address[1]
+        metadata.JsonRequest.close_all()
+
+    def tearDown(self):
+        metadata.JsonRequest.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def new_request(self):
+        req = metadata.JsonRequest()
+        req.init_request(self.url, 5)
+        return req
+
+    def test_one_connection(self):
+        for _ in range(3):
+            req = self.new_request()
+            self.assertTrue(req.put())
+            self.assertEqual(req.get_out("access_token"), "myToken")
+        self.assertEqual(KeepAliveStub.connections, 1)
+
+    def test_reconnect_when_closed(self):
+        self.assertTrue(self.new_request().put())
+        for conn in metadata.JsonRequest.idle.values():
+            conn.sock.shutdown(socket.SHUT_RDWR)  # as if the server timed it out
+        self.assertTrue(self.new_request().put())
+        self.assertEqual(KeepAliveStub.connections, 2)
+
+    def test_response_size_bounded(self):
+        with mock.patch.object(metadata, "META_MAX_RESPONSE_BYTES", 10):
+            req = self.new_request()
+            req.EnableLogStore()
+            req.SetDebugEnabled()
+            self.assertFalse(req.put())
+        self.assertTrue(req.HasLogMessage("Response over 10 bytes"))
+        self.assertEqual(metadata.JsonRequest.idle, {})
 
 
 class TestMetadata(unittest.TestCase):
+    def setUp(self):
+        use_temp_cache(self, metadata.TokenCache)
+
     def test_new_request_with_token(self):
         metadata.META_VERSION = "myVersion"
         meta = newMetadata()
@@ -154,6 +279,12 @@ class TestMetadata(unittest.TestCase):
         self.assertEqual(req.headers, {'Accept': 'application/json'})
         self.assertIsNone(req.context)
 
+    def test_new_request_other_port(self):
+        meta = newMetadata()
+        meta.port = 8080
+        req = meta.new_request("my/Url")
+        self.assertEqual(req.url, "http://169.254.169.254:8080/my/Url")
+
     def test_set_private_key_good(self):
         meta = newMetadata()
         ret = meta.set_private_key(TEST_PRIVATE_KEY)
@@ -241,6 +372,58 @@ class TestMetadata(unittest.TestCase):
         self.assertFalse(ret)
         self.assertEqual(req.put.call_count, 1)
 
+    def test_get_token_cached(self):
+        meta, req = newRequest("put", True, {"access_token": "myToken", "expires_in": 300})
+        self.assertTrue(meta.get_token())
+        self.assertFalse(meta.token_cached)
+        meta2, req2 = newRequest("put", True, {"access_token": "other", "expires_in": 300})
+        self.assertTrue(meta2.get_token())
+        self.assertTrue(meta2.token_cached)
+        self.assertEqual(meta2.token, "myToken")
+        self.assertEqual(req2.put.call_count, 0)
+        self.assertTrue(meta2.HasLogMessage("Token cache hit, hit rate 50% (1 of 2)"))
+
+        metadata.TokenCache.cache["expires_at"] = time.time() - 1
+        self.assertTrue(meta2.get_token())
+        self.assertEqual(meta2.token, "other")
+        self.assertEqual(req2.put.call_count, 1)
+
+    def test_get_token_short_expiry_not_cached(self):
+        meta, req = newRequest("put", True, {"access_token": "myToken", "expires_in": 30})
+        self.assertTrue(meta.get_token())
+        self.assertTrue(meta.get_token())
+        self.assertEqual(req.put.call_count, 2)
+
+    def test_generate_certs_unauthorized_renews_token(self):
+        resp = {"certificates": [TEST_CERT, TEST_CERT], "created_at": "ca", "expires_at": "ea"}
+        metadata.TokenCache().put("oldToken", 300)
+        meta = newMetadata()
+        self.assertTrue(meta.get_token())
+        self.assertTrue(meta.token_cached)
+
+        denied = newJRequest()
+        denied.post = MagicMock(return_value=False)
+        denied.status = metadata.HTTP_UNAUTHORIZED
+        token = newJRequest()
+        token.put = MagicMock(return_value=True)
+        token.response = {"access_token": "newToken", "expires_in": 300}
+        certs = newJRequest()
+        certs.post = MagicMock(return_value=True)
+        certs.response = resp
+        meta.new_request = MagicMock(side_effect=[denied, token, certs])
+        meta.csr = "myCsr"
+        self.assertTrue(meta.generate_certs())
+        self.assertEqual(meta.token, "newToken")
+        self.assertEqual(metadata.TokenCache.cache["token"], "newToken")
+
+        # a new token that is refused is not retried
+        denied.post.reset_mock()
+        meta.new_request = MagicMock(side_effect=[denied])
+        meta.token_cached = False
+        self.assertFalse(meta.generate_certs())
+        self.assertEqual(denied.post.call_count, 1)
+        self.assertNotIn("token", metadata.TokenCache.cache)
+
 
 if __name__ == '__main__':
     unittest.main()
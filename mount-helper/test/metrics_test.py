@@ -0,0 +1,88 @@
+# Copyright (c) IBM Corp. 2025. All Rights Reserved.
+# Project name: VPC File Storage Mount Helper
+# This project is licensed under the MIT License, see LICENSE file in the root directory.
+
+from unittest import mock
+import unittest
+from test_common import *
+from common import *
+from certificate_handler import CryptoX509
+from metrics import Metrics, METRICS_PROM_FILE, metric_key
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = test_folder.get_temp_filename("metrics")
+        os.makedirs(self.dir)
+        self.prom_file = os.path.join(self.dir, METRICS_PROM_FILE)
+        Metrics.pending = []
+        Metrics.certs = {}
+        self.patches = [
+            mock.patch.object(Metrics, "STATE_FILE", os.path.join(self.dir, "state.json")),
+            mock.patch.object(Metrics, "get_dir", return_value=self.dir),
+            mock.patch.object(Metrics, "count_ipsec_configs", return_value=3),
+            mock.patch.object(LocalInstall, "exists", return_value=True),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        Metrics.pending = []
+        Metrics.certs = {}
+
+    def prom_lines(self):
+        with open(self.prom_file) as fd:
+            return fd.read().splitlines()
+
+    def test_metric_key(self):
+        self.assertEqual(metric_key("abc"), "abc")
+        self.assertEqual(metric_key("abc", {"b": 2, "a": "x"}), 'abc{a="x",b="2"}')
+
+    def test_counters_accumulate(self):
+        labels = {"run_type": "MNT", "transport": "ipsec", "result": "ok"}
+        for _ in range(2):
+            Metrics.inc("ibmshare_runs_total", labels)
+            self.assertTrue(Metrics().flush())
+        self.assertEqual(Metrics.pending, [])
+        lines = self.prom_lines()
+        self.assertIn("# TYPE ibmshare_runs_total counter", lines)
+        self.assertIn(metric_key("ibmshare_runs_total", labels) + " 2", lines)
+        self.assertIn("ibmshare_ipsec_config_files 3", lines)
+        self.assertFalse([f for f in os.listdir(self.dir) if f.endswith(".tmp")])
+
+    def test_histogram(self):
+        done = Metrics.timed("ibmshare_cleanup", {"kind": "stunnel"})
+        done(False)
+        Metrics.observe("ibmshare_cleanup_duration_seconds", 7, {"kind": "stunnel"})
+        self.assertTrue(Metrics().flush())
+        lines = self.prom_lines()
+        name = "ibmshare_cleanup_duration_seconds"
+        self.assertIn("# TYPE %s histogram" % name, lines)
+        self.assertIn('%s_bucket{kind="stunnel",le="0.1"} 1' % name, lines)
+        self.assertIn('%s_bucket{kind="stunnel",le="10"} 2' % name, lines)
+        self.assertIn('%s_bucket{kind="stunnel",le="+Inf"} 2' % name, lines)
+        self.assertIn('%s_count{kind="stunnel"} 2' % name, lines)
+        self.assertIn('ibmshare_cleanups_total{kind="stunnel",result="error"} 1', lines)
+
+    def test_cert_expiry(self):
+        crt = CryptoX509()
+        crt.not_after = datetime.now(timezone.utc) + timedelta(days=2)
+        Metrics.cert_expiry("client", crt)
+        self.assertTrue(Metrics().flush())
+        line = [l for l in self.prom_lines() if l.startswith("ibmshare_cert_expiry")][0]
+        secs = int(line.split()[1])
+        self.assertTrue(2 * 86400 - 60 < secs <= 2 * 86400)
+
+    def test_no_collector_dir(self):
+        Metrics.inc("ibmshare_runs_total")
+        with mock.patch.object(Metrics, "get_dir", return_value=None):
+            self.assertFalse(Metrics().flush())
+        self.assertFalse(os.path.exists(self.prom_file))
+        self.assertEqual(Metrics.pending, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
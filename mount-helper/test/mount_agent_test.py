@@ -0,0 +1,110 @@
+# Copyright (c) IBM Corp. 2025. All Rights Reserved.
+# Project name: VPC File Storage Mount Helper
+# This project is licensed under the MIT License, see LICENSE file in the root directory.
+
+from unittest import mock
+import unittest
+import socket
+import threading
+from test_common import *
+from common import *
+from mount_agent import MountAgent, MountAgentClient
+
+
+class FakeApp:
+    runs = []
+    cwds = []
+
+    def run(self):
+        FakeApp.runs.append(list(sys.argv))
+        FakeApp.cwds.append(os.getcwd())
+        print("mounted " + sys.argv[1])
+        if sys.argv[1] == "fail":
+            SysApp.set_code(SysApp.ERR_MOUNT)
+            return False
+        return True
+
+
+@mock.patch("mount_agent.MountAgent.is_peer_root", return_value=True)
+class TestMountAgent(unittest.TestCase):
+
+    def setUp(self):
+        FakeApp.runs = []
+        FakeApp.cwds = []
+        self.path = test_folder.get_temp_filename(".sock")
+        self.agent = MountAgent(FakeApp, self.path)
+        self.thread = threading.Thread(target=self.agent.serve, daemon=True)
+        self.thread.start()
+        for _ in range(100):
+            if self.agent.server and os.path.exists(self.path):
+                break
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.agent.server.shutdown()
+        self.thread.join(5)
+        MountTable.invalidate()
+
+    def test_forward_mount(self, _):
+        saved = list(sys.argv)
+        code = MountAgentClient(self.path, 5).forward(["mount.ibmshare", "ok"])
+        self.assertEqual(code, 0)
+        self.assertEqual(FakeApp.runs, [["mount.ibmshare", "ok"]])
+        self.assertEqual(sys.argv, saved)
+
+    def test_forward_mount_client_cwd(self, _):
+        saved = os.getcwd()
+        folder = os.path.dirname(self.path)
+        req = {"action": "mount", "argv": ["mount.ibmshare", "ok"], "cwd": folder}
+        reply = MountAgentClient(self.path, 5).request(req)
+        self.assertEqual(reply["code"], 0)
+        self.assertEqual(FakeApp.cwds, [folder])
+        self.assertEqual(os.getcwd(), saved)
+        req["cwd"] = "/does/not/exist"
+        reply = MountAgentClient(self.path, 5).request(req)
+        self.assertEqual(reply["code"], 1)
+        self.assertEqual(len(FakeApp.runs), 1)
+
+    def test_forward_mount_failed(self, _):
+        code = MountAgentClient(self.path, 5).forward(["mount.ibmshare", "fail"])
+        self.assertEqual(code, SysApp.ERR_MOUNT)
+
+    def test_status(self, _):
+        with mock.patch("common.MountTable.load", return_value=MountTable([])):
+            reply = MountAgentClient(self.path, 5).request({"action": "status"})
+        self.assertEqual(reply["code"], 0)
+        self.assertEqual(reply["data"]["pid"], os.getpid())
+        self.assertEqual(reply["data"]["mounts"], [])
+
+    def test_unknown_action(self, _):
+        reply = MountAgentClient(self.path, 5).request({"action": "reboot"})
+        self.assertEqual(reply["code"], 1)
+        self.assertIn("Unknown", reply["output"])
+
+
+class TestMountAgentClient(unittest.TestCase):
+
+    def test_no_agent_falls_back(self):
+        client = MountAgentClient("/run/does/not/exist.sock", 1)
+        self.assertIsNone(client.forward(["mount.ibmshare"]))
+
+    def test_dead_socket_falls_back(self):
+        path = test_folder.get_temp_filename(".sock")
+        write_file(path, "")
+        self.assertIsNone(MountAgentClient(path, 1).forward(["mount.ibmshare"]))
+
+    def test_lost_reply_does_not_fall_back(self):
+        path = test_folder.get_temp_filename(".sock")
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(1)
+        try:
+            # connected but the agent never replies
+            code = MountAgentClient(path, 0.2).forward(["mount.ibmshare"])
+        finally:
+            server.close()
+        self.assertEqual(code, SysApp.ERR_APP_GENERIC)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -97,6 +97,24 @@ class TestMountIbmshare(unittest.TestCase):
         self.assertEqual(mis.is_share_mounted.call_count, count)
         self.delete_conf_files_dir(config_dir)
 
+    # Stale cleanup reads the mount table once for all conf files.
+    @mock.patch("common.NfsMount.load_nfs_mounts")
+    def test_cleanup_stale_conf_single_snapshot(self, load_nfs_mounts):
+        load_nfs_mounts.return_value = [
+            common.NfsMount(mount_ibmshare.LOOPBACK_ADDRESS, "/C0FFEE1", "/mnt")
+        ]
+        config_dir, count = self.create_conf_files()
+        common.MountTable.invalidate()
+        mis = mount_ibmshare.MountIbmshare()
+        mis.RemoveFile = MagicMock(return_value=True)
+        mis.kill_stunnel_pid = MagicMock(return_value=True)
+        mis.cleanup_stale_conf(dirname=config_dir)
+
+        self.assertEqual(load_nfs_mounts.call_count, 1)
+        self.assertEqual(mis.kill_stunnel_pid.call_count, count - 1)
+        common.MountTable.invalidate()
+        self.delete_conf_files_dir(config_dir)
+
     # Conf file in a requested dir
     def create_custom_conf_file(self, conf_dir, config_filename, pidval):
         pid_file_name = os.path.join(conf_dir, "ibmshare_C0FFEE.pid")
@@ -200,34 +218,28 @@ class TestMountIbmshare(unittest.TestCase):
     def fake_get_trusted_ca_file(self):
         return "/dev/null"
 
-    @mock.patch("subprocess.run")
-    def test_start_stunnel(self, subprocess_handle):
+    @mock.patch.object(common.SubProcess, "run", autospec=True)
+    def test_start_stunnel(self, run_handle):
         with patch.object(
             StunnelConfigCreate,
             "get_trusted_ca_file",
             new=self.fake_get_trusted_ca_file,
         ):
-            subprocess_handle.return_value.returncode = 0
-            subprocess_handle.return_value = subprocess.CompletedProcess(
-                args=["dummy", "dummy"], returncode=0
-            )
+            run_handle.side_effect = lambda proc: proc.set_output(0, b"", b"")
             mis = mount_ibmshare.MountIbmshare()
             ret = mis.start_stunnel(10001, "10.10.1.1", "/C0FFEE")
             self.assertEqual(ret, True)
-            self.assertEqual(1, subprocess_handle.call_count)
-            self.assertEqual(subprocess_handle.call_args[0][0][0], STUNNEL_COMMAND)
+            self.assertEqual(1, run_handle.call_count)
+            proc = run_handle.call_args[0][0]
+            self.assertEqual(proc.cmd[0], STUNNEL_COMMAND)
             self.assertEqual(
                 os.path.join(self.config_dir, "ibmshare_C0FFEE_10-10-1-1.conf"),
-                subprocess_handle.call_args[0][0][1],
+                proc.cmd[1],
             )
+            self.assertTrue(proc.env["PATH"].startswith("/usr/bin:/usr/sbin:"))
 
-            subprocess_handle.return_value = subprocess.CompletedProcess(
-                args=["stunnel", "This_is_an_Incorrect_file_name.conf"],
-                returncode=99,
-                stdout="",
-                stderr="This error was intentionally simulated in a unit test".encode(
-                    "utf-8"
-                ),
+            run_handle.side_effect = lambda proc: proc.set_output(
+                99, b"", b"This error was intentionally simulated in a unit test"
             )
             ret = mis.start_stunnel(10001, "10.10.1.1", "/C0FFEE")
             self.assertEqual(ret, False)
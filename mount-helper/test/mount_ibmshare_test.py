@@ -48,8 +48,11 @@ def init_ocert(
     return ox
 
 
+# Force the mount command fallback by hiding mountinfo.
+@mock.patch("common.NfsMount.MOUNTINFO_FILE", "/proc/does/not/exist")
 def do_already_mounted(ret=0, data="", ip="", path=""):
     mo = mount_ibmshare.MountIbmshare()
+    MountTable.invalidate()
     with MySubProcess(ret, data) as run:
         ret = mo.is_share_mounted(ip, path)
     return mo, ret
@@ -0,0 +1,166 @@
+# Copyright (c) IBM Corp. 2025. All Rights Reserved.
+# Project name: VPC File Storage Mount Helper
+# This project is licensed under the MIT License, see LICENSE file in the root directory.
+
+from unittest.mock import MagicMock
+from unittest import mock
+import unittest
+import json
+from test_common import *
+from common import *
+from reconcile_shares import ReconcileShares, ShareManifest
+
+SHARES = [
+    {"source": "10.0.0.1:/share1", "mountpoint": "/mnt/s1", "transport": "ipsec"},
+    {"source": "10.0.0.2:/share2", "mountpoint": "/mnt/s2", "options": "rw"},
+    {"source": "10.0.0.3:/share3", "mountpoint": "/mnt/s3", "transport": "stunnel"},
+    {"source": "10.0.0.4:/share4", "mountpoint": "/mnt/s4", "transport": "ipsec"},
+]
+
+
+def write_manifest(data, postfix=".json"):
+    fname = test_folder.get_temp_filename(postfix)
+    write_file(fname, data if isinstance(data, str) else json.dumps(data))
+    return fname
+
+
+def load_shares():
+    manifest = ShareManifest(write_manifest(SHARES))
+    assert manifest.load()
+    return manifest.shares
+
+
+def new_mounter(mounted=None):
+    mounter = MagicMock()
+    mounter.prepare_mount.return_value = True
+    mounter.add_ipsec_config.return_value = True
+    mounter.prepare_stunnel_mount.return_value = 10001
+    mounter.run_mount_cmd.return_value = True
+    mounter.run_stunnel_mount_command.return_value = True
+    mounter.set_installed_stunnel.return_value = True
+    ipsec = MagicMock()
+    ipsec.reload_config.return_value = True
+    mounter.get_ipsec_mgr.return_value = ipsec
+    MountTable.current = MountTable(mounted if mounted else [])
+    return mounter, ipsec
+
+
+class TestShareManifest(unittest.TestCase):
+
+    def test_load_json(self):
+        manifest = ShareManifest(write_manifest({"shares": SHARES}))
+        self.assertTrue(manifest.load())
+        self.assertEqual(len(manifest.shares), 4)
+        args = manifest.shares[0]
+        self.assertTrue(args.is_secure)
+        self.assertEqual(args.ip_address, "10.0.0.1")
+        self.assertEqual(manifest.shares[1].options, "rw")
+        self.assertTrue(manifest.shares[2].is_stunnel)
+
+    def test_load_yaml(self):
+        data = "shares:\n  - source: 10.0.0.1:/share1\n    mountpoint: /mnt/s1\n"
+        manifest = ShareManifest(write_manifest(data, ".yaml"))
+        try:
+            import yaml
+        except ImportError:
+            self.assertFalse(manifest.load())
+            return
+        self.assertTrue(manifest.load())
+        self.assertEqual(manifest.shares[0].mount_point, "/mnt/s1")
+
+    def test_load_errors(self):
+        self.assertFalse(ShareManifest(write_manifest("not json")).load())
+        self.assertFalse(ShareManifest(write_manifest({"shares": "x"})).load())
+        bad = [{"source": "10.0.0.1:/s", "mountpoint": "/m", "transport": "nfs3"}]
+        self.assertFalse(ShareManifest(write_manifest(bad)).load())
+        self.assertFalse(ShareManifest("/does/not/exist.json").load())
+
+    def test_load_ipsec_ip_conflict(self):
+        shares = SHARES + [{"source": "10.0.0.1:/other", "mountpoint": "/mnt/o"}]
+        self.assertFalse(ShareManifest(write_manifest(shares)).load())
+        # stunnel mounts go through the local stunnel port
+        shares = SHARES + [
+            {"source": "10.0.0.1:/other", "mountpoint": "/mnt/o", "transport": "stunnel"}
+        ]
+        self.assertTrue(ShareManifest(write_manifest(shares)).load())
+
+
+class TestReconcileShares(unittest.TestCase):
+
+    def tearDown(self):
+        MountTable.invalidate()
+
+    def test_apply_mounts_all(self):
+        mounter, ipsec = new_mounter()
+        ret = ReconcileShares(mounter).apply(write_manifest(SHARES))
+        self.assertTrue(ret)
+        self.assertEqual(mounter.prepare_mount.call_count, 1)
+        self.assertEqual(mounter.prepare_mount.call_args[1], {"reload": False})
+        # one cert check for both IPsec shares
+        self.assertEqual(mounter.prepare_ipsec.call_count, 1)
+        self.assertEqual(mounter.add_ipsec_config.call_count, 2)
+        self.assertEqual(ipsec.reload_config.call_count, 1)
+        self.assertEqual(mounter.cleanup_stale_conf.call_count, 1)
+        self.assertEqual(mounter.run_mount_cmd.call_count, 3)
+        self.assertEqual(mounter.run_stunnel_mount_command.call_count, 1)
+        self.assertEqual(mounter.ca_certs_alert.call_count, 1)
+        self.assertEqual(mounter.lock.call_count, 1)
+
+    def test_apply_skips_mounted(self):
+        mounted = [
+            NfsMount("10.0.0.1", "/share1", "/mnt/s1"),
+            NfsMount("127.0.0.1", "/share3", "/mnt/s3", "10001"),
+            NfsMount("10.0.0.9", "/other", "/mnt/s4"),
+        ]
+        mounter, _ = new_mounter(mounted)
+        ret = ReconcileShares(mounter).apply(write_manifest(SHARES))
+        self.assertTrue(ret)
+        self.assertEqual(mounter.run_mount_cmd.call_count, 2)
+        self.assertEqual(mounter.run_stunnel_mount_command.call_count, 0)
+        self.assertEqual(mounter.set_installed_stunnel.call_count, 0)
+
+    def test_apply_remounts_changed_server_or_mode(self):
+        mounted = [
+            NfsMount("10.0.0.9", "/share1", "/mnt/s1"),  # other server
+            NfsMount("10.0.0.2", "/share2", "/mnt/s2", options="rw,xprtsec=tls"),
+            NfsMount("10.0.0.4", "/share4", "/mnt/s4"),
+        ]
+        mounter, ipsec = new_mounter(mounted)
+        # no IPsec config for the IPsec share on 10.0.0.4
+        ipsec.get_config.return_value = None
+        needed = ReconcileShares(mounter).get_needed(load_shares())
+        self.assertEqual(
+            [args.mount_point for args in needed], ["/mnt/s1", "/mnt/s2", "/mnt/s3", "/mnt/s4"]
+        )
+        ipsec.get_config.return_value = "type_ibmshare_10.0.0.4.conf"
+        mounted[1].options = "rw"
+        needed = ReconcileShares(mounter).get_needed(load_shares())
+        self.assertEqual([args.mount_point for args in needed], ["/mnt/s1", "/mnt/s3"])
+
+    def test_apply_reload_fails(self):
+        mounter, ipsec = new_mounter()
+        ipsec.reload_config.return_value = False
+        ret = ReconcileShares(mounter).apply(write_manifest(SHARES))
+        self.assertFalse(ret)
+        # only the plain share mounts
+        self.assertEqual(mounter.run_mount_cmd.call_count, 1)
+        self.assertEqual(mounter.run_stunnel_mount_command.call_count, 1)
+
+    def test_apply_prepare_ipsec_fails(self):
+        mounter, _ = new_mounter()
+        mounter.prepare_ipsec.return_value = None
+        ret = ReconcileShares(mounter).apply(write_manifest(SHARES))
+        self.assertFalse(ret)
+        self.assertEqual(mounter.add_ipsec_config.call_count, 0)
+        self.assertEqual(mounter.run_mount_cmd.call_count, 1)
+        self.assertEqual(mounter.run_stunnel_mount_command.call_count, 1)
+
+    def test_apply_mount_fails(self):
+        mounter, _ = new_mounter()
+        mounter.run_mount_cmd.return_value = False
+        ret = ReconcileShares(mounter).apply(write_manifest(SHARES))
+        self.assertFalse(ret)
+
+
+if __name__ == "__main__":
+    unittest.main()
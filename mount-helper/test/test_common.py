@@ -9,6 +9,8 @@ import tempfile
 import random
 from config import SubProcess
 from common import *
+from certificate_handler import CertCache
+from metadata import Metadata, TokenCache
 import stunnel_config_get
 import stunnel_config_create
 from find_free_stunnel_port import FindFreeSTunnelPort
@@ -253,6 +255,23 @@ class MyTempDir:
 
 
 test_folder = MyTempDir()
+PlatformCaps.CACHE_FILE = test_folder.get_temp_filename("platform-caps.json")
+CertCache.CACHE_FILE = test_folder.get_temp_filename("cert-cache.json")
+TokenCache.CACHE_FILE = test_folder.get_temp_filename("metadata-token.json")
+NameResolver.CACHE_FILE = test_folder.get_temp_filename("resolver-cache.json")
+Metadata.ENDPOINT_FILE = test_folder.get_temp_filename("metadata-endpoint.json")
+
+
+# Point the state files of the cache classes at new temp files for one test.
+def use_temp_cache(test, *cache_classes):
+    def restore(cache_class, fpath):
+        cache_class.CACHE_FILE = fpath
+        cache_class.cache = None
+
+    for cache_class in cache_classes:
+        test.addCleanup(restore, cache_class, cache_class.CACHE_FILE)
+        cache_class.CACHE_FILE = test_folder.get_temp_filename(".json")
+        cache_class.cache = None
 
 
 def test_cleanup():